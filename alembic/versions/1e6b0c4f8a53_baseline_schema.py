@@ -0,0 +1,102 @@
+"""baseline schema: tables that existed before migrations
+
+Revision ID: 1e6b0c4f8a53
+Revises:
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1e6b0c4f8a53'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # До миграций схему создавал create_all при старте приложения: на таких
+    # базах эти таблицы уже есть, и ревизия их не трогает
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'employees' not in existing:
+        op.create_table(
+            'employees',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('full_name', sa.String(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_employees_id', 'employees', ['id'])
+
+    if 'departments' not in existing:
+        op.create_table(
+            'departments',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('dep_name', sa.String(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_departments_id', 'departments', ['id'])
+
+    if 'employee_department' not in existing:
+        op.create_table(
+            'employee_department',
+            sa.Column('employee_id', sa.Integer(), nullable=False),
+            sa.Column('department_id', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['employee_id'], ['employees.id']),
+            sa.ForeignKeyConstraint(['department_id'], ['departments.id']),
+            sa.PrimaryKeyConstraint('employee_id', 'department_id'),
+        )
+
+    if 'events' not in existing:
+        op.create_table(
+            'events',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('employee_id', sa.Integer(), nullable=False),
+            sa.Column('event_type', sa.String(), nullable=False),
+            sa.Column('start_date', sa.Date(), nullable=False),
+            sa.Column('end_date', sa.Date(), nullable=False),
+            sa.Column('level', sa.String(), nullable=False),
+            sa.ForeignKeyConstraint(['employee_id'], ['employees.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_events_id', 'events', ['id'])
+
+    if 'daily_workloads' not in existing:
+        op.create_table(
+            'daily_workloads',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('employee_id', sa.Integer(), nullable=False),
+            sa.Column('date', sa.Date(), nullable=False),
+            sa.Column('percent', sa.Float(), nullable=False),
+            sa.ForeignKeyConstraint(['employee_id'], ['employees.id']),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('employee_id', 'date', name='unique_employee_date'),
+        )
+        op.create_index('ix_daily_workloads_id', 'daily_workloads', ['id'])
+
+    if 'history' not in existing:
+        op.create_table(
+            'history',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('employee_id', sa.Integer(), nullable=False),
+            sa.Column('event_type', sa.String(), nullable=False),
+            sa.Column('date', sa.Date(), nullable=False),
+            sa.Column('verdict', sa.Integer(), nullable=False),
+            sa.Column('level', sa.String(), nullable=False),
+            sa.Column('participant_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['employee_id'], ['employees.id']),
+            sa.ForeignKeyConstraint(['participant_id'], ['employees.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_history_id', 'history', ['id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('history', 'daily_workloads', 'events', 'employee_department', 'departments', 'employees'):
+        op.drop_table(table)
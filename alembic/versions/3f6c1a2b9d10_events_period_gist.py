@@ -0,0 +1,94 @@
+"""events: daterange column, GiST index and approved overlap exclusion
+
+Revision ID: 3f6c1a2b9d10
+Revises: 1e6b0c4f8a53
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f6c1a2b9d10'
+down_revision: Union[str, Sequence[str], None] = '1e6b0c4f8a53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # На базах, созданных create_all до появления миграций, объекты уже
+    # могут быть, поэтому миграция не должна падать на существующих.
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    op.execute(
+        "ALTER TABLE events ADD COLUMN IF NOT EXISTS period daterange "
+        "GENERATED ALWAYS AS (daterange(start_date, end_date, '[]')) STORED"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_events_period ON events USING gist (period)")
+    demote_overlapping_approved()
+    op.execute(
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'events_approved_no_overlap') THEN
+                ALTER TABLE events ADD CONSTRAINT events_approved_no_overlap
+                    EXCLUDE USING gist (employee_id WITH =, period WITH &&)
+                    WHERE (level = 'approved');
+            END IF;
+        END
+        $$
+        """
+    )
+
+
+def demote_overlapping_approved() -> None:
+    """
+    Старый update_event не проверял пересечения, и в базе могут быть
+    пересекающиеся согласованные события одного сотрудника - с ними
+    ограничение не создастся. У каждого сотрудника события идут по дате
+    начала (при равных - по id): событие, пересекающее уже оставленное
+    согласованным, переводится в 'saved'. Переведённые id пишутся в лог
+    """
+    bind = op.get_bind()
+    if bind.scalar(sa.text("SELECT 1 FROM pg_constraint WHERE conname = 'events_approved_no_overlap'")):
+        return
+    rows = bind.execute(sa.text("""
+        SELECT e.id, e.employee_id, e.start_date, e.end_date
+        FROM events e
+        WHERE e.level = 'approved' AND EXISTS (
+            SELECT 1 FROM events o
+            WHERE o.level = 'approved' AND o.employee_id = e.employee_id AND o.id <> e.id
+              AND o.start_date <= e.end_date AND e.start_date <= o.end_date
+        )
+        ORDER BY e.employee_id, e.start_date, e.id
+    """)).all()
+
+    kept, demoted = {}, []
+    for event_id, employee_id, start, end in rows:
+        if any(start <= kept_end and kept_start <= end for kept_start, kept_end in kept.get(employee_id, [])):
+            demoted.append(event_id)
+        else:
+            kept.setdefault(employee_id, []).append((start, end))
+    if demoted:
+        bind.execute(
+            sa.text("UPDATE events SET level = 'saved' WHERE id = ANY(:ids)"),
+            {'ids': demoted},
+        )
+        logger.warning(
+            "Overlapping approved events demoted to 'saved' before adding events_approved_no_overlap: %s",
+            ', '.join(map(str, demoted)),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE events DROP CONSTRAINT IF EXISTS events_approved_no_overlap")
+    op.execute("DROP INDEX IF EXISTS ix_events_period")
+    op.execute("ALTER TABLE events DROP COLUMN IF EXISTS period")
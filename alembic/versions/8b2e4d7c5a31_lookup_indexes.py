@@ -0,0 +1,42 @@
+"""foreign-key and lookup indexes
+
+Revision ID: 8b2e4d7c5a31
+Revises: 3f6c1a2b9d10
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4d7c5a31'
+down_revision: Union[str, Sequence[str], None] = '3f6c1a2b9d10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = {
+    'ix_events_employee_dates': 'events (employee_id, start_date, end_date)',
+    'ix_daily_workloads_date_employee': 'daily_workloads (date, employee_id)',
+    'ix_history_employee_id': 'history (employee_id)',
+    'ix_history_participant_id': 'history (participant_id)',
+    'ix_employee_department_department_id': 'employee_department (department_id, employee_id)',
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY не блокирует запись в таблицы, но не работает внутри транзакции
+    with op.get_context().autocommit_block():
+        for name, target in INDEXES.items():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
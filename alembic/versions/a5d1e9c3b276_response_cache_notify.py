@@ -0,0 +1,90 @@
+"""NOTIFY triggers for response cache invalidation
+
+Revision ID: a5d1e9c3b276
+Revises: f2b8c6a1d047
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a5d1e9c3b276'
+down_revision: Union[str, Sequence[str], None] = 'f2b8c6a1d047'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Таблица -> аргументы триггера (колонки начала и конца диапазона дат)
+TABLES = {
+    'events': "'start_date', 'end_date'",
+    'daily_workloads': "'date', 'date'",
+    'employees': '',
+}
+TRANSITIONS = {
+    'INSERT': 'NEW TABLE AS new_rows',
+    'UPDATE': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+    'DELETE': 'OLD TABLE AS old_rows',
+}
+
+
+def _operations(table):
+    # Для employees важны только переименование и удаление
+    return [op_name for op_name in TRANSITIONS if table != 'employees' or op_name != 'INSERT']
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_response_cache() RETURNS trigger AS $$
+        DECLARE
+            bounds record;
+        BEGIN
+            IF TG_TABLE_NAME = 'employees' THEN
+                IF TG_OP = 'DELETE' AND EXISTS (SELECT 1 FROM old_rows)
+                   OR TG_OP = 'UPDATE' AND EXISTS (
+                       SELECT 1 FROM old_rows o JOIN new_rows n USING (id) WHERE o.full_name IS DISTINCT FROM n.full_name
+                   ) THEN
+                    PERFORM pg_notify('response_cache', json_build_object('table', TG_TABLE_NAME)::text);
+                END IF;
+                RETURN NULL;
+            END IF;
+
+            IF TG_OP = 'INSERT' THEN
+                EXECUTE format('SELECT min(%I) AS lo, max(%I) AS hi FROM new_rows', TG_ARGV[0], TG_ARGV[1]) INTO bounds;
+            ELSIF TG_OP = 'DELETE' THEN
+                EXECUTE format('SELECT min(%I) AS lo, max(%I) AS hi FROM old_rows', TG_ARGV[0], TG_ARGV[1]) INTO bounds;
+            ELSE
+                EXECUTE format(
+                    'SELECT min(lo) AS lo, max(hi) AS hi FROM ('
+                    'SELECT min(%1$I) AS lo, max(%2$I) AS hi FROM old_rows '
+                    'UNION ALL SELECT min(%1$I), max(%2$I) FROM new_rows) r',
+                    TG_ARGV[0], TG_ARGV[1]
+                ) INTO bounds;
+            END IF;
+            IF bounds.lo IS NOT NULL THEN
+                PERFORM pg_notify('response_cache', json_build_object('table', TG_TABLE_NAME, 'start', bounds.lo, 'end', bounds.hi)::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table, args in TABLES.items():
+        for op_name in _operations(table):
+            name = f"{table}_notify_response_cache_{op_name.lower()}"
+            op.execute(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+            op.execute(
+                f"CREATE TRIGGER {name} AFTER {op_name} ON {table} REFERENCING {TRANSITIONS[op_name]} "
+                f"FOR EACH STATEMENT EXECUTE FUNCTION notify_response_cache({args})"
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        for op_name in _operations(table):
+            op.execute(f"DROP TRIGGER IF EXISTS {table}_notify_response_cache_{op_name.lower()} ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS notify_response_cache()")
@@ -0,0 +1,68 @@
+"""Previous employee and dates in event_changes for live subscriptions
+
+Revision ID: a8d2f4c6e917
+Revises: e5c7a9d1b384
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d2f4c6e917'
+down_revision: Union[str, Sequence[str], None] = 'e5c7a9d1b384'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('event_changes', sa.Column('old_employee_id', sa.Integer(), nullable=True), if_not_exists=True)
+    op.add_column('event_changes', sa.Column('old_start_date', sa.Date(), nullable=True), if_not_exists=True)
+    op.add_column('event_changes', sa.Column('old_end_date', sa.Date(), nullable=True), if_not_exists=True)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION log_event_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO event_changes (event_id, op, old_employee_id, old_start_date, old_end_date)
+                VALUES (OLD.id, 'delete', OLD.employee_id, OLD.start_date, OLD.end_date);
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO event_changes (
+                    event_id, op, employee_id, event_type, start_date, end_date, level,
+                    old_employee_id, old_start_date, old_end_date
+                )
+                VALUES (
+                    NEW.id, 'upsert', NEW.employee_id, NEW.event_type, NEW.start_date, NEW.end_date, NEW.level,
+                    OLD.employee_id, OLD.start_date, OLD.end_date
+                );
+            ELSE
+                INSERT INTO event_changes (event_id, op, employee_id, event_type, start_date, end_date, level)
+                VALUES (NEW.id, 'upsert', NEW.employee_id, NEW.event_type, NEW.start_date, NEW.end_date, NEW.level);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("""
+        CREATE OR REPLACE FUNCTION log_event_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO event_changes (event_id, op) VALUES (OLD.id, 'delete');
+            ELSE
+                INSERT INTO event_changes (event_id, op, employee_id, event_type, start_date, end_date, level)
+                VALUES (NEW.id, 'upsert', NEW.employee_id, NEW.event_type, NEW.start_date, NEW.end_date, NEW.level);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.drop_column('event_changes', 'old_end_date')
+    op.drop_column('event_changes', 'old_start_date')
+    op.drop_column('event_changes', 'old_employee_id')
@@ -0,0 +1,80 @@
+"""NOTIFY trigger for the month-segmented workload cache
+
+Revision ID: b9e4c2d7f153
+Revises: a5d1e9c3b276
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b9e4c2d7f153'
+down_revision: Union[str, Sequence[str], None] = 'a5d1e9c3b276'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TRANSITIONS = {
+    'INSERT': 'NEW TABLE AS new_rows',
+    'UPDATE': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+    'DELETE': 'OLD TABLE AS old_rows',
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_workload_blocks() RETURNS trigger AS $$
+        DECLARE
+            employee_ids integer[];
+            months date[];
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT array_agg(employee_id), array_agg(month) INTO employee_ids, months
+                FROM (SELECT DISTINCT employee_id, date_trunc('month', date)::date AS month FROM new_rows) c;
+            ELSIF TG_OP = 'DELETE' THEN
+                SELECT array_agg(employee_id), array_agg(month) INTO employee_ids, months
+                FROM (SELECT DISTINCT employee_id, date_trunc('month', date)::date AS month FROM old_rows) c;
+            ELSE
+                SELECT array_agg(employee_id), array_agg(month) INTO employee_ids, months
+                FROM (
+                    SELECT employee_id, date_trunc('month', date)::date AS month FROM old_rows
+                    UNION SELECT employee_id, date_trunc('month', date)::date FROM new_rows
+                ) c;
+            END IF;
+
+            IF employee_ids IS NULL THEN
+                RETURN NULL;
+            ELSIF cardinality(employee_ids) <= 250 THEN
+                PERFORM pg_notify('workload_blocks', json_build_object(
+                    'pairs', (SELECT json_agg(json_build_array(e, m)) FROM unnest(employee_ids, months) AS u(e, m))
+                )::text);
+            ELSIF (SELECT count(DISTINCT m) FROM unnest(months) AS m) <= 250 THEN
+                PERFORM pg_notify('workload_blocks', json_build_object(
+                    'months', (SELECT json_agg(DISTINCT m) FROM unnest(months) AS m)
+                )::text);
+            ELSE
+                PERFORM pg_notify('workload_blocks', json_build_object('all', true)::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for op_name, referencing in TRANSITIONS.items():
+        name = f"daily_workloads_notify_workload_blocks_{op_name.lower()}"
+        op.execute(f"DROP TRIGGER IF EXISTS {name} ON daily_workloads")
+        op.execute(
+            f"CREATE TRIGGER {name} AFTER {op_name} ON daily_workloads REFERENCING {referencing} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION notify_workload_blocks()"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for op_name in TRANSITIONS:
+        op.execute(f"DROP TRIGGER IF EXISTS daily_workloads_notify_workload_blocks_{op_name.lower()} ON daily_workloads")
+    op.execute("DROP FUNCTION IF EXISTS notify_workload_blocks()")
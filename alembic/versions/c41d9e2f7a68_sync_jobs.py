@@ -0,0 +1,44 @@
+"""sync_jobs table for background Bitrix sync
+
+Revision ID: c41d9e2f7a68
+Revises: 8b2e4d7c5a31
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d9e2f7a68'
+down_revision: Union[str, Sequence[str], None] = '8b2e4d7c5a31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Таблицу мог уже создать create_all (до перехода на миграции при старте)
+    if not sa.inspect(op.get_bind()).has_table('sync_jobs'):
+        op.create_table(
+            'sync_jobs',
+            sa.Column('id', sa.String(), nullable=False),
+            sa.Column('trigger', sa.String(), nullable=False),
+            sa.Column('status', sa.String(), nullable=False),
+            sa.Column('stage', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+            sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('timings', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+            sa.Column('result', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+            sa.Column('error', sa.String(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('sync_jobs')
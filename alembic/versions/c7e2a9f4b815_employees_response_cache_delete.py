@@ -0,0 +1,100 @@
+"""Fix employees DELETE in notify_response_cache (no new_rows in DELETE triggers)
+
+Revision ID: c7e2a9f4b815
+Revises: a8d2f4c6e917
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e2a9f4b815'
+down_revision: Union[str, Sequence[str], None] = 'a8d2f4c6e917'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_response_cache() RETURNS trigger AS $$
+        DECLARE
+            bounds record;
+            changed boolean;
+        BEGIN
+            IF TG_TABLE_NAME = 'employees' THEN
+                -- Отдельные ветки: в триггере на DELETE нет new_rows, и запрос с ним не спланируется
+                IF TG_OP = 'DELETE' THEN
+                    changed := EXISTS (SELECT 1 FROM old_rows);
+                ELSE
+                    changed := EXISTS (
+                        SELECT 1 FROM old_rows o JOIN new_rows n USING (id) WHERE o.full_name IS DISTINCT FROM n.full_name
+                    );
+                END IF;
+                IF changed THEN
+                    PERFORM pg_notify('response_cache', json_build_object('table', TG_TABLE_NAME)::text);
+                END IF;
+                RETURN NULL;
+            END IF;
+
+            IF TG_OP = 'INSERT' THEN
+                EXECUTE format('SELECT min(%I) AS lo, max(%I) AS hi FROM new_rows', TG_ARGV[0], TG_ARGV[1]) INTO bounds;
+            ELSIF TG_OP = 'DELETE' THEN
+                EXECUTE format('SELECT min(%I) AS lo, max(%I) AS hi FROM old_rows', TG_ARGV[0], TG_ARGV[1]) INTO bounds;
+            ELSE
+                EXECUTE format(
+                    'SELECT min(lo) AS lo, max(hi) AS hi FROM ('
+                    'SELECT min(%1$I) AS lo, max(%2$I) AS hi FROM old_rows '
+                    'UNION ALL SELECT min(%1$I), max(%2$I) FROM new_rows) r',
+                    TG_ARGV[0], TG_ARGV[1]
+                ) INTO bounds;
+            END IF;
+            IF bounds.lo IS NOT NULL THEN
+                PERFORM pg_notify('response_cache', json_build_object('table', TG_TABLE_NAME, 'start', bounds.lo, 'end', bounds.hi)::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_response_cache() RETURNS trigger AS $$
+        DECLARE
+            bounds record;
+        BEGIN
+            IF TG_TABLE_NAME = 'employees' THEN
+                IF TG_OP = 'DELETE' AND EXISTS (SELECT 1 FROM old_rows)
+                   OR TG_OP = 'UPDATE' AND EXISTS (
+                       SELECT 1 FROM old_rows o JOIN new_rows n USING (id) WHERE o.full_name IS DISTINCT FROM n.full_name
+                   ) THEN
+                    PERFORM pg_notify('response_cache', json_build_object('table', TG_TABLE_NAME)::text);
+                END IF;
+                RETURN NULL;
+            END IF;
+
+            IF TG_OP = 'INSERT' THEN
+                EXECUTE format('SELECT min(%I) AS lo, max(%I) AS hi FROM new_rows', TG_ARGV[0], TG_ARGV[1]) INTO bounds;
+            ELSIF TG_OP = 'DELETE' THEN
+                EXECUTE format('SELECT min(%I) AS lo, max(%I) AS hi FROM old_rows', TG_ARGV[0], TG_ARGV[1]) INTO bounds;
+            ELSE
+                EXECUTE format(
+                    'SELECT min(lo) AS lo, max(hi) AS hi FROM ('
+                    'SELECT min(%1$I) AS lo, max(%2$I) AS hi FROM old_rows '
+                    'UNION ALL SELECT min(%1$I), max(%2$I) FROM new_rows) r',
+                    TG_ARGV[0], TG_ARGV[1]
+                ) INTO bounds;
+            END IF;
+            IF bounds.lo IS NOT NULL THEN
+                PERFORM pg_notify('response_cache', json_build_object('table', TG_TABLE_NAME, 'start', bounds.lo, 'end', bounds.hi)::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
@@ -0,0 +1,57 @@
+"""table_versions counters for ETags
+
+Revision ID: d3a8f1b6e520
+Revises: b9e4c2d7f153
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a8f1b6e520'
+down_revision: Union[str, Sequence[str], None] = 'b9e4c2d7f153'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ('events', 'daily_workloads', 'employees', 'departments', 'employee_department')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Таблицу мог уже создать create_all (до перехода на миграции при старте)
+    if not sa.inspect(op.get_bind()).has_table('table_versions'):
+        op.create_table(
+            'table_versions',
+            sa.Column('table_name', sa.String(), nullable=False),
+            sa.Column('version', sa.BigInteger(), nullable=False),
+            sa.PrimaryKeyConstraint('table_name'),
+        )
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO table_versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table in TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_bump_table_version ON {table}")
+        op.execute(
+            f"CREATE TRIGGER {table}_bump_table_version "
+            f"AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_bump_table_version ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS bump_table_version()")
+    op.drop_table('table_versions')
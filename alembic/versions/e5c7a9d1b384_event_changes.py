@@ -0,0 +1,63 @@
+"""event_changes log for /calendar/changes
+
+Revision ID: e5c7a9d1b384
+Revises: d3a8f1b6e520
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5c7a9d1b384'
+down_revision: Union[str, Sequence[str], None] = 'd3a8f1b6e520'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS event_changes (
+            id BIGSERIAL PRIMARY KEY,
+            txid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+            event_id INTEGER NOT NULL,
+            op VARCHAR NOT NULL,
+            employee_id INTEGER,
+            event_type VARCHAR,
+            start_date DATE,
+            end_date DATE,
+            level VARCHAR,
+            changed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+    """)
+    op.create_index('ix_event_changes_txid', 'event_changes', ['txid'], if_not_exists=True)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION log_event_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO event_changes (event_id, op) VALUES (OLD.id, 'delete');
+            ELSE
+                INSERT INTO event_changes (event_id, op, employee_id, event_type, start_date, end_date, level)
+                VALUES (NEW.id, 'upsert', NEW.employee_id, NEW.event_type, NEW.start_date, NEW.end_date, NEW.level);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("DROP TRIGGER IF EXISTS events_log_change ON events")
+    op.execute(
+        "CREATE TRIGGER events_log_change AFTER INSERT OR UPDATE OR DELETE ON events "
+        "FOR EACH ROW EXECUTE FUNCTION log_event_change()"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS events_log_change ON events")
+    op.execute("DROP FUNCTION IF EXISTS log_event_change()")
+    op.drop_index('ix_event_changes_txid', table_name='event_changes')
+    op.drop_table('event_changes')
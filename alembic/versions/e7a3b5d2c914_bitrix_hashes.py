@@ -0,0 +1,36 @@
+"""bitrix_hashes table for change detection in Bitrix sync
+
+Revision ID: e7a3b5d2c914
+Revises: c41d9e2f7a68
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a3b5d2c914'
+down_revision: Union[str, Sequence[str], None] = 'c41d9e2f7a68'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Таблицу мог уже создать create_all (до перехода на миграции при старте)
+    if not sa.inspect(op.get_bind()).has_table('bitrix_hashes'):
+        op.create_table(
+            'bitrix_hashes',
+            sa.Column('entity', sa.String(), nullable=False),
+            sa.Column('record_id', sa.Integer(), nullable=False),
+            sa.Column('hash', sa.String(), nullable=False),
+            sa.PrimaryKeyConstraint('entity', 'record_id'),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('bitrix_hashes')
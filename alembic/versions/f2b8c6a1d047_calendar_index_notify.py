@@ -0,0 +1,51 @@
+"""NOTIFY triggers for the in-memory calendar index
+
+Revision ID: f2b8c6a1d047
+Revises: e7a3b5d2c914
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b8c6a1d047'
+down_revision: Union[str, Sequence[str], None] = 'e7a3b5d2c914'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ('events', 'employees')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_calendar_index() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('calendar_index', json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'id', OLD.id)::text);
+                RETURN OLD;
+            END IF;
+            PERFORM pg_notify('calendar_index', json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'row', row_to_json(NEW))::text);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table in TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_notify_calendar_index ON {table}")
+        op.execute(
+            f"CREATE TRIGGER {table}_notify_calendar_index "
+            f"AFTER INSERT OR UPDATE OR DELETE ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION notify_calendar_index()"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_notify_calendar_index ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS notify_calendar_index()")
@@ -0,0 +1,36 @@
+"""event_changes retention: changed_at index and pruning horizon
+
+Revision ID: f4a6c8e2d159
+Revises: c7e2a9f4b815
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4a6c8e2d159'
+down_revision: Union[str, Sequence[str], None] = 'c7e2a9f4b815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_event_changes_changed_at', 'event_changes', ['changed_at'], if_not_exists=True)
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS event_changes_pruned (
+            id SERIAL PRIMARY KEY,
+            txid xid8 NOT NULL,
+            pruned_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('event_changes_pruned')
+    op.drop_index('ix_event_changes_changed_at', table_name='event_changes')
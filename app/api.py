@@ -1,66 +1,174 @@
 from datetime import date
-from fastapi import APIRouter, HTTPException, Query, Depends
+from typing import Dict, Literal, Optional, Union
+from fastapi import APIRouter, HTTPException, Query, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
 from app.models import *
 from app.services import *
-from app.database import get_db
-from sqlalchemy.orm import Session
+from app.database import get_db, get_pool_status
+from app.scheduler import sync_scheduler
+from app import webhooks
+from app.auth import Principal, require_role, ensure_role
+from app.response_cache import response_cache
+from app.etags import conditional_response
+from app.live import CALENDAR_LIVE, Subscription, calendar_live
+from app.workload import workload_blocks
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 
 router = APIRouter()
 
-
-@router.get("/calendar", response_model=list[CalendarResponseItem])
+@router.get("/calendar", response_model=list[CalendarResponseItem], dependencies=[Depends(require_role('viewer'))])
 async def get_calendar(
+    request: Request,
     start_date: date = Query(..., description="Дата начала периода (YYYY-MM-DD)"),
     end_date: date = Query(..., description="Дата окончания периода (YYYY-MM-DD)"),
-    db: Session = Depends(get_db)
+    format: Literal['json', 'ndjson'] = Query('json', description="ndjson - потоком, строка на сотрудника (для больших выгрузок)"),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Получить календарь отпусков и командировок
     """
+    async def build():
+        return await CalendarService.get_calendar_json(db, start_date, end_date)
+
+    async def render(headers: Dict[str, str]):
+        # Токен берётся до чтения данных: изменения после него придут в /calendar/changes
+        headers = {**headers, 'X-Sync-Token': await CalendarService.sync_token(db)}
+        if format == 'ndjson':
+            # Большие выгрузки не кэшируются, а читаются курсором и сразу отдаются
+            return CalendarService.stream_calendar(start_date, end_date), headers
+        return await response_cache.get_or_render('calendar', start_date, end_date, {}, build, headers)
+
     try:
-        result = CalendarService.get_calendar(db, start_date, end_date)
-        return result
+        return await conditional_response(
+            request, db, 'calendar', {'start_date': start_date, 'end_date': end_date, 'format': format}, render,
+            media_type='application/x-ndjson' if format == 'ndjson' else 'application/json',
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.get("/workload", response_model=WorkloadResponse)
+@router.get("/calendar/changes", response_model=CalendarChangesResponse, dependencies=[Depends(require_role('viewer'))])
+async def get_calendar_changes(
+    since: str = Query(..., description="Токен из X-Sync-Token ответа /calendar или из прошлого ответа /calendar/changes"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Изменения событий календаря после токена: новые и изменённые события
+    целиком, удалённые - с deleted=true
+    """
+    try:
+        return await CalendarService.get_changes(db, since)
+    except SyncTokenExpired as e:
+        # Изменения после токена уже удалены из журнала: клиент перечитывает /calendar
+        raise HTTPException(status_code=410, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/calendar/live", dependencies=[Depends(require_role('viewer'))])
+async def get_calendar_live(
+    since: str = Query(..., description="Токен из X-Sync-Token ответа /calendar или из прошлой пачки"),
+    start_date: Optional[date] = Query(default=None, description="Начало окна дат (вместе с end_date)"),
+    end_date: Optional[date] = Query(default=None, description="Конец окна дат"),
+    department_id: Optional[int] = Query(default=None, description="Только события сотрудников отдела"),
+):
+    """
+    Push изменений календаря (Server-Sent Events). Событие changes несёт то же,
+    что ответ /calendar/changes; reset - клиент отстал, календарь нужно перечитать
+    """
+    if not CALENDAR_LIVE:
+        raise HTTPException(status_code=404, detail="Push изменений выключен (CALENDAR_LIVE)")
+    if not SYNC_TOKEN_PATTERN.fullmatch(since):
+        raise HTTPException(status_code=400, detail="Некорректный токен синхронизации")
+    if (start_date is None) != (end_date is None):
+        raise HTTPException(status_code=400, detail="Окно задаётся обеими датами: start_date и end_date")
+    if start_date is not None and start_date > end_date:
+        raise HTTPException(status_code=400, detail="Start date cannot be after end date")
+
+    subscription = Subscription(since, start_date, end_date, department_id)
+    return StreamingResponse(
+        calendar_live.stream(subscription),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@router.get(
+    "/workload",
+    response_model=Union[WorkloadResponse, WorkloadSeriesResponse, WorkloadRunsResponse],
+    dependencies=[Depends(require_role('viewer'))],
+)
 async def get_workload(
+    request: Request,
     start_date: date = Query(..., description="Дата начала периода (YYYY-MM-DD)"),
     end_date: date = Query(..., description="Дата окончания периода (YYYY-MM-DD)"),
-    db: Session = Depends(get_db)
+    aggregate: Literal['python', 'sql'] = Query('python', description="Где считать загрузку: в приложении или в Postgres"),
+    format: Literal['dense', 'series', 'rle'] = Query(
+        'dense', description="dense - по элементу на день; series и rle - компактные ряды для тепловой карты",
+    ),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Получить ежедневную загрузку сотрудников
     """
+    async def build():
+        return await WorkloadService.get_workload_json(db, start_date, end_date, aggregate, format)
+
+    async def render(headers: Dict[str, str]):
+        return await response_cache.get_or_render(
+            'workload', start_date, end_date, {'aggregate': aggregate, 'format': format}, build, headers,
+        )
+
     try:
-        result = WorkloadService.get_workload(db, start_date, end_date)
-        return result
+        params = {'start_date': start_date, 'end_date': end_date, 'aggregate': aggregate, 'format': format}
+        return await conditional_response(request, db, 'workload', params, render)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     
 @router.post("/events", response_model=CreateCalendarEventResponse)
 async def create_event(
     event_data: CreateCalendarEvent,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(require_role('editor')),
 ):
     """
     Создать новое событие (отпуск или командировка)
     """
+    if event_data.level == 'approved':
+        ensure_role(user, 'approver')
     try:
-        result = CalendarService.create_event(db, event_data)
+        result = await CalendarService.create_event(db, event_data)
         return CreateCalendarEventResponse(id=result.id)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/events:batch", response_model=CreateCalendarEventsBatchResponse)
+async def create_events_batch(
+    batch: CreateCalendarEventsBatch,
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(require_role('editor')),
+):
+    """
+    Создать пачку событий одной транзакцией (например, план отпусков отдела).
+    Для каждого события возвращается id или причина, по которой оно не создано
+    """
+    if any(event_data.level == 'approved' for event_data in batch.events):
+        ensure_role(user, 'approver')
+    try:
+        return await CalendarService.create_events(db, batch.events)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
 
-@router.delete("/events/{event_id}", response_model=DeleteEventResponse)
+@router.delete("/events/{event_id}", response_model=DeleteEventResponse, dependencies=[Depends(require_role('editor'))])
 async def delete_event(
     event_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Удалить событие календаря по ID
@@ -69,7 +177,7 @@ async def delete_event(
         event_id: ID события для удаления
     """
     try:
-        success = CalendarService.delete_event(db, CalendarEventDelete(event_id=event_id))
+        success = await CalendarService.delete_event(db, CalendarEventDelete(event_id=event_id))
         if not success:
             raise HTTPException(status_code=404, detail=f"Событие с ID {event_id} не найдено")
         return DeleteEventResponse(event_id=event_id)
@@ -81,7 +189,8 @@ async def delete_event(
 async def update_event_dates(
     event_id: int,
     update_data: UpdateCalendarEventDates,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    user: Principal = Depends(require_role('editor')),
 ):
     """
     Обновить даты события календаря
@@ -90,8 +199,10 @@ async def update_event_dates(
         event_id: ID события для обновления
         update_data: Новые даты начала и окончания
     """
+    if update_data.new_level == 'approved':
+        ensure_role(user, 'approver')
     try:
-        updated_event = CalendarService.update_event(
+        updated_event = await CalendarService.update_event(
             db,
             CalendarEventUpdateDates(
                 event_id=event_id,
@@ -109,48 +220,119 @@ async def update_event_dates(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.get('/departments', response_model=DepartmentsResponse)
-def get_departments(db: Session = Depends(get_db)):
-    data = DepartmentService.get_departments(db)
-    return DepartmentsResponse(
-        data
-    )
+@router.get('/departments', response_model=DepartmentsResponse, dependencies=[Depends(require_role('viewer'))])
+async def get_departments(request: Request, db: AsyncSession = Depends(get_db)):
+    async def render(headers: Dict[str, str]):
+        data = await DepartmentService.get_departments(db)
+        return DepartmentsResponse(data).model_dump_json().encode(), headers
+
+    return await conditional_response(request, db, 'departments', {}, render)
 
-@router.get('/employees', response_model=GetemployeeResponse)
-def get_employees(
-    department_id = Query(default=None, description='ID отдела, для которого надо получить сотрудников'),
-    db: Session = Depends(get_db)
+@router.get('/employees', response_model=GetemployeeResponse, dependencies=[Depends(require_role('viewer'))])
+async def get_employees(
+    request: Request,
+    department_id: Optional[int] = Query(default=None, description='ID отдела, для которого надо получить сотрудников'),
+    db: AsyncSession = Depends(get_db)
 ):
-    data = EmployeeService.get_employees_with_departments(db, department_id)
-    return data
+    async def render(headers: Dict[str, str]):
+        data = await EmployeeService.get_employees_with_departments(db, department_id)
+        return data.model_dump_json().encode(), headers
 
-@router.patch('/data')
-def update_data(db: Session = Depends(get_db)):
-    """Обновляет данные из битрикса"""
-    a = BitrixService(db).sync_with_bitrix()
-    return a
+    return await conditional_response(request, db, 'employees', {'department_id': department_id}, render)
 
-@router.post('/auth')
-def auth(
-    token: AuthToken,
-    db: Session = Depends(get_db)
+@router.patch('/data', status_code=202, response_model=SyncJobCreatedResponse, dependencies=[Depends(require_role('admin'))])
+async def update_data(
+    force: bool = Query(False, description="Полная сверка без учёта хэшей прошлой синхронизации"),
 ):
+    """Ставит в очередь обновление данных из битрикса"""
+    job = await sync_scheduler.enqueue(force)
+    return SyncJobCreatedResponse(job_id=job.id, status=job.status)
+
+@router.get('/data/jobs/{job_id}', response_model=SyncJobResponse, dependencies=[Depends(require_role('admin'))])
+async def get_sync_job(job_id: str):
+    """Статус, этап и длительность этапов синхронизации с битриксом"""
+    job = await sync_scheduler.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задача синхронизации {job_id} не найдена")
+    return SyncJobResponse.model_validate(job)
+
+@router.post('/bitrix/events', response_model=BitrixEventResponse)
+async def bitrix_event(request: Request):
+    """
+    Приёмник исходящих вебхуков битрикса (ONUSER*, ONDEPARTMENT*).
+    События копятся и применяются пачкой раз в BITRIX_WEBHOOK_WINDOW секунд
+    """
+    if not webhooks.BITRIX_APP_TOKEN:
+        raise HTTPException(status_code=404, detail="Приём вебхуков выключен (BITRIX_APP_TOKEN)")
+    content_type = request.headers.get('content-type', '')
+    try:
+        body = (await request.body()).decode()
+        payload = webhooks.parse_payload(body, content_type)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректное тело запроса")
+    if not webhooks.check_token(payload):
+        raise HTTPException(status_code=401, detail="Неверный application_token")
+
+    try:
+        event = webhooks.parse_event(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if event is None:
+        return BitrixEventResponse(accepted=False)
+    if webhooks.BITRIX_WEBHOOK_RECORD:
+        await run_in_threadpool(webhooks.record, body, content_type)
+    webhooks.webhook_buffer.add(*event)
+    return BitrixEventResponse(accepted=True)
+
+@router.post('/auth')
+async def auth(token: AuthToken):
     """Авторизация пользователя"""
-    role = AuthService.check_role(token.auth_token, token.app_name)
+    try:
+        role = await AuthService.check_role(token.auth_token, token.app_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if role is None:
+        raise HTTPException(status_code=401, detail="Токен отклонён сервисом авторизации")
     return {'role': role}
 
-@router.get('/documents')
+@router.get('/metrics/auth', dependencies=[Depends(require_role('admin'))])
+async def get_auth_metrics():
+    """Доля попаданий в кэш вердиктов и стоимость обращений к сервису авторизации"""
+    return AuthService.metrics()
+
+@router.get('/metrics/response-cache', dependencies=[Depends(require_role('admin'))])
+async def get_response_cache_metrics():
+    """Попадания в кэш ответов /calendar и /workload и его размер"""
+    return await response_cache.stats()
+
+@router.get('/metrics/workload-blocks', dependencies=[Depends(require_role('admin'))])
+async def get_workload_blocks_metrics():
+    """Помесячный кэш загрузки: сколько месяцев в памяти и сколько дочитано из базы"""
+    return workload_blocks.stats()
+
+@router.delete('/auth/cache', dependencies=[Depends(require_role('admin'))])
+async def clear_auth_cache():
+    """Сбрасывает кэш вердиктов, например после смены ролей в сервисе авторизации"""
+    AuthService.clear_cache()
+    return {'message': 'success'}
+
+@router.get('/metrics/db-pool', dependencies=[Depends(require_role('admin'))])
+async def get_db_pool_metrics():
+    """Состояние пула соединений с БД и время ожидания соединения"""
+    return get_pool_status()
+
+@router.get('/documents', dependencies=[Depends(require_role('viewer'))])
 def get_documents(
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # TODO: Create document service
     return {
         'data': 'documents'
     }
 
-@router.get('/history')
+@router.get('/history', dependencies=[Depends(require_role('viewer'))])
 def get_history(
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # TODO: Create history service
     return {
@@ -0,0 +1,90 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException
+
+from app.services import AuthService
+
+logger = logging.getLogger(__name__)
+
+# Проверять ли токен на защищённых маршрутах
+AUTH_ENABLED = os.getenv('AUTH_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Роли по возрастанию прав: каждая следующая может всё, что предыдущие
+AUTH_ROLES = [role.strip() for role in os.getenv('AUTH_ROLES', 'viewer,editor,approver,admin').split(',') if role.strip()]
+# Приложение по умолчанию, если клиент не передал X-App-Name
+AUTH_APP_NAME = os.getenv('AUTH_APP_NAME', 'calendar')
+
+
+@dataclass
+class Principal:
+    token: Optional[str]
+    app_name: str
+    role: Optional[str]  # None, если авторизация выключена
+
+
+def warn_if_disabled():
+    """При старте: без AUTH_ENABLED все маршруты, включая админские, открыты"""
+    if not AUTH_ENABLED:
+        logger.warning("AUTH_ENABLED is off: all routes, including admin ones, are open without a token")
+
+
+def role_rank(role: Optional[str]) -> int:
+    """Ранг роли в AUTH_ROLES; неизвестная роль ниже любой известной"""
+    return AUTH_ROLES.index(role) if role in AUTH_ROLES else -1
+
+
+def ensure_role(principal: Principal, min_role: str):
+    """Проверка роли внутри маршрута, когда она зависит от тела запроса"""
+    if AUTH_ENABLED and role_rank(principal.role) < role_rank(min_role):
+        raise HTTPException(status_code=403, detail=f"Недостаточно прав: нужна роль {min_role}")
+
+
+async def authenticate(
+    authorization: Optional[str] = Header(default=None, description="Bearer <auth_token>"),
+    x_app_name: Optional[str] = Header(default=None, description="Имя приложения для сервиса авторизации"),
+) -> Principal:
+    """
+    Определяет роль по токену из заголовка Authorization. Вердикт берётся
+    из кэша AuthService, в сервис авторизации запрос уходит только при промахе
+    """
+    app_name = x_app_name or AUTH_APP_NAME
+    if not AUTH_ENABLED:
+        return Principal(token=None, app_name=app_name, role=None)
+
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise HTTPException(
+            status_code=401,
+            detail="Нужен заголовок Authorization: Bearer <token>",
+            headers={'WWW-Authenticate': 'Bearer'},
+        )
+    try:
+        role = await AuthService.check_role(token, app_name)
+    except ValueError:
+        raise HTTPException(status_code=503, detail="Сервис авторизации недоступен")
+    if role is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Токен отклонён сервисом авторизации",
+            headers={'WWW-Authenticate': 'Bearer'},
+        )
+    return Principal(token=token, app_name=app_name, role=role)
+
+
+def require_role(min_role: str):
+    """
+    Зависимость маршрута: аутентификация и минимальная роль.
+
+        @router.get(..., dependencies=[Depends(require_role('viewer'))])
+        async def route(user: Principal = Depends(require_role('editor'))): ...
+    """
+    if min_role not in AUTH_ROLES:
+        raise ValueError(f"Неизвестная роль {min_role}, допустимые: {AUTH_ROLES}")
+
+    async def dependency(principal: Principal = Depends(authenticate)) -> Principal:
+        ensure_role(principal, min_role)
+        return principal
+
+    return dependency
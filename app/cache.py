@@ -0,0 +1,95 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    In-memory кэш с TTL на запись и ограничением размера (LRU).
+
+    get_or_load склеивает одновременные промахи по одному ключу: загрузчик
+    вызывается один раз в отдельной задаче, все ждут её результата. Исключения
+    загрузчика не кэшируются
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: Hashable, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: Optional[Callable[[Any], float]] = None,
+    ):
+        """
+        Возвращает значение из кэша или загружает его. ttl(value) позволяет
+        задать срок жизни в зависимости от результата (например, короче
+        для отрицательных ответов)
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader, ttl))
+            # Исключение получают ожидающие; если все отменены - не даём ему всплыть как "never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        # Загрузка общая: отмена одного ожидающего, в том числе запустившего её, не отменяет остальных
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl: Optional[Callable[[Any], float]]):
+        try:
+            value = await loader()
+            self.set(key, value, None if ttl is None else ttl(value))
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+        }
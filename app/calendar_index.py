@@ -0,0 +1,241 @@
+import heapq
+import json
+import logging
+import os
+from datetime import date
+from itertools import groupby
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from app.database import CalendarEvent, Employee, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Держать ли события в памяти воркера и отвечать /calendar из неё
+CALENDAR_INDEX = os.getenv('CALENDAR_INDEX', 'false').lower() in ('1', 'true', 'yes')
+# Канал NOTIFY, в который триггеры events/employees пишут изменения
+CALENDAR_INDEX_CHANNEL = 'calendar_index'
+# Сколько изменённых событий копить поверх массивов, прежде чем пересобрать их целиком
+CALENDAR_INDEX_REBUILD_AFTER = 1000
+
+
+class _Intervals:
+    """
+    Интервалы [start, end], отсортированные по start, с префиксным максимумом
+    end. Пересечение с [s, e] ищется двумя бинарными поисками: кандидаты
+    лежат между первым индексом, где max_end >= s, и последним start <= e
+    """
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, rows: np.ndarray):
+        order = np.lexsort((rows, starts))
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.rows = rows[order]
+        self.max_end = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+    def overlapping(self, start: int, end: int) -> np.ndarray:
+        lo = np.searchsorted(self.max_end, start, side='left')
+        hi = np.searchsorted(self.starts, end, side='right')
+        if lo >= hi:
+            return self.rows[:0]
+        return self.rows[lo:hi][self.ends[lo:hi] >= start]
+
+
+class CalendarIndex:
+    """
+    Все события календаря в памяти воркера.
+
+    Источник правды - словарь событий по id. Для /calendar из него строятся
+    массивы numpy с индексом интервалов; изменённые после сборки события
+    (_changed) не пересобирают массивы, а проверяются отдельно при чтении,
+    пока их не наберётся CALENDAR_INDEX_REBUILD_AFTER. Согласованные события
+    для проверки пересечений хранятся по сотрудникам и обновляются на месте.
+    Изменения приходят сразу из CalendarService (write-through) и из NOTIFY
+    от триггеров, чтобы индекс совпадал на всех воркерах
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._events: Dict[int, Tuple[int, str, int, int, str]] = {}  # id -> (employee_id, type, start, end, level)
+        self._employees: Dict[int, str] = {}
+        self._dirty = True
+        self._columns = None
+        self._all: Optional[_Intervals] = None
+        self._changed: Set[int] = set()  # id событий, изменённых или удалённых после сборки массивов
+        self._approved: Dict[int, Dict[int, Tuple[int, int]]] = {}  # сотрудник -> {id: (start, end)}
+        # Уведомления, пришедшие во время load(): применяются к новому состоянию
+        self._loading: Optional[List[str]] = None
+
+    async def load(self):
+        """
+        Полная загрузка из базы (при старте и после переподключения LISTEN).
+        LISTEN уже подключён, но уведомления, пришедшие во время чтения,
+        могут быть новее или старше прочитанного - они копятся и применяются
+        по порядку поверх загруженного
+        """
+        self._loading = []
+        try:
+            async with SessionLocal() as db:
+                employees = (await db.execute(select(Employee.id, Employee.full_name))).all()
+                events = (await db.execute(select(
+                    CalendarEvent.id,
+                    CalendarEvent.employee_id,
+                    CalendarEvent.event_type,
+                    CalendarEvent.start_date,
+                    CalendarEvent.end_date,
+                    CalendarEvent.level,
+                ))).all()
+        except BaseException:
+            self._loading = None
+            raise
+        self._employees = dict(employees)
+        self._events = {
+            event_id: (employee_id, event_type, start.toordinal(), end.toordinal(), level)
+            for event_id, employee_id, event_type, start, end, level in events
+        }
+        self._approved = {}
+        for event_id, (employee_id, _, start, end, level) in self._events.items():
+            if level == 'approved':
+                self._approved.setdefault(employee_id, {})[event_id] = (start, end)
+        self._dirty = True
+
+        queued, self._loading = self._loading, None
+        for payload in queued:
+            try:
+                self.handle_notification(payload)
+            except Exception:
+                logger.exception("Failed to apply queued calendar index notification")
+        self.ready = True
+        logger.info(
+            "Calendar index loaded: %d events, %d employees, %d queued notifications",
+            len(self._events), len(self._employees), len(queued),
+        )
+
+    def unload(self):
+        """LISTEN оборвался: пока индекс не перезагружен, чтения идут в базу"""
+        self.ready = False
+
+    # -- Изменения --
+
+    def put_event(self, event_id: int, employee_id: int, event_type: str, start: date, end: date, level: str):
+        self._forget_approved(event_id)
+        self._events[event_id] = (employee_id, event_type, start.toordinal(), end.toordinal(), level)
+        if level == 'approved':
+            self._approved.setdefault(employee_id, {})[event_id] = (start.toordinal(), end.toordinal())
+        self._touch(event_id)
+
+    def drop_event(self, event_id: int):
+        self._forget_approved(event_id)
+        if self._events.pop(event_id, None) is not None:
+            self._touch(event_id)
+
+    def _forget_approved(self, event_id: int):
+        event = self._events.get(event_id)
+        if event is not None and event[4] == 'approved':
+            intervals = self._approved.get(event[0], {})
+            intervals.pop(event_id, None)
+            if not intervals:
+                self._approved.pop(event[0], None)
+
+    def _touch(self, event_id: int):
+        self._changed.add(event_id)
+        if len(self._changed) > CALENDAR_INDEX_REBUILD_AFTER:
+            self._dirty = True
+
+    def handle_notification(self, payload: str):
+        """Применяет уведомление триггера notify_calendar_index"""
+        if self._loading is not None:
+            self._loading.append(payload)
+            return
+        message = json.loads(payload)
+        row = message.get('row')
+        if message['table'] == 'events':
+            if message['op'] == 'DELETE':
+                self.drop_event(message['id'])
+            else:
+                self.put_event(
+                    row['id'],
+                    row['employee_id'],
+                    row['event_type'],
+                    date.fromisoformat(row['start_date']),
+                    date.fromisoformat(row['end_date']),
+                    row['level'],
+                )
+        elif message['table'] == 'employees':
+            if message['op'] == 'DELETE':
+                self._employees.pop(message['id'], None)
+            else:
+                self._employees[row['id']] = row['full_name']
+
+    # -- Чтение --
+
+    def _rebuild(self):
+        if not self._dirty:
+            return
+        count = len(self._events)
+        ids = np.fromiter(self._events.keys(), dtype=np.int64, count=count)
+        values = list(self._events.values())
+        employee_ids = np.fromiter((v[0] for v in values), dtype=np.int64, count=count)
+        starts = np.fromiter((v[2] for v in values), dtype=np.int64, count=count)
+        ends = np.fromiter((v[3] for v in values), dtype=np.int64, count=count)
+
+        self._columns = (ids, employee_ids, starts, ends)
+        self._all = _Intervals(starts, ends, np.arange(count))
+        self._changed = set()
+        self._dirty = False
+
+    def has_approved_overlap(self, employee_id: int, start: date, end: date) -> bool:
+        # У сотрудника немного согласованных событий: массивы для этого не нужны
+        start, end = start.toordinal(), end.toordinal()
+        return any(
+            event_start <= end and event_end >= start
+            for event_start, event_end in self._approved.get(employee_id, {}).values()
+        )
+
+    def calendar_items(self, start_date: date, end_date: date) -> Optional[List[dict]]:
+        """
+        Календарь за период простыми словарями, в том же виде и порядке, что и запрос к базе.
+        None - если индекс не знает кого-то из сотрудников (уведомление
+        ещё не дошло), тогда ответ нужно взять из базы
+        """
+        self._rebuild()
+        lo, hi = start_date.toordinal(), end_date.toordinal()
+        ids, employee_ids, starts, ends = self._columns
+        rows = self._all.overlapping(lo, hi)
+        if self._changed:
+            # Изменённые после сборки события в массивах устарели: берём их из словаря
+            rows = rows[~np.isin(ids[rows], np.fromiter(self._changed, dtype=np.int64, count=len(self._changed)))]
+        # Порядок как в запросе: сотрудник, дата начала, id
+        rows = rows[np.lexsort((ids[rows], starts[rows], employee_ids[rows]))]
+        found = zip(employee_ids[rows].tolist(), starts[rows].tolist(), ids[rows].tolist())
+        if self._changed:
+            changed = sorted(
+                (event[0], event[2], event_id)
+                for event_id, event in ((event_id, self._events.get(event_id)) for event_id in self._changed)
+                if event is not None and event[2] <= hi and event[3] >= lo
+            )
+            found = heapq.merge(found, changed)
+
+        result = []
+        for employee_id, group in groupby(found, key=lambda item: item[0]):
+            full_name = self._employees.get(employee_id)
+            if full_name is None:
+                return None
+            events = []
+            for _, _, event_id in group:
+                _, event_type, start, end, level = self._events[event_id]
+                events.append({
+                    'id': event_id,
+                    'type': event_type,
+                    'start': date.fromordinal(start),
+                    'end': date.fromordinal(end),
+                    'level': level,
+                })
+            result.append({'employee': {'id': employee_id, 'full_name': full_name}, 'events': events})
+
+        return result
+
+
+calendar_index = CalendarIndex()
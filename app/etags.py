@@ -0,0 +1,69 @@
+import hashlib
+import json
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, Tuple, Union
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import TableVersion
+
+# От каких таблиц зависит ответ каждого маршрута
+ETAG_TABLES = {
+    'calendar': ('events', 'employees'),
+    'workload': ('daily_workloads', 'employees'),
+    'employees': ('employees', 'departments', 'employee_department'),
+    'departments': ('departments',),
+}
+
+
+async def table_versions(db: AsyncSession, tables: Iterable[str]) -> Dict[str, int]:
+    """Текущие версии таблиц; таблица, которую ещё не меняли, имеет версию 0"""
+    versions = dict.fromkeys(tables, 0)
+    rows = (await db.execute(
+        select(TableVersion.table_name, TableVersion.version).where(TableVersion.table_name.in_(list(versions)))
+    )).all()
+    versions.update(rows)
+    return versions
+
+
+def make_etag(kind: str, versions: Dict[str, int], params: Dict[str, object]) -> str:
+    """Сильный ETag: одинаковые версии таблиц и параметры запроса дают одно и то же тело"""
+    raw = json.dumps([kind, versions, params], sort_keys=True, default=str)
+    return '"' + hashlib.sha256(raw.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match сравнивается слабо: W/"x" совпадает с "x" """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+async def conditional_response(
+    request: Request,
+    db: AsyncSession,
+    kind: str,
+    params: Dict[str, object],
+    render: Callable[[Dict[str, str]], Awaitable[Tuple[Union[bytes, AsyncIterator[bytes]], Dict[str, str]]]],
+    media_type: str = 'application/json',
+) -> Response:
+    """
+    Ответ GET с ETag. Если клиент прислал актуальный ETag в If-None-Match,
+    сразу отдаётся 304: ни запроса к данным, ни сериализации.
+    render(headers) получает заголовки с ETag и возвращает тело (байты или
+    асинхронный итератор для потоковой отдачи) и заголовки, с которыми его
+    можно отдать
+    """
+    etag = make_etag(kind, await table_versions(db, ETAG_TABLES[kind]), params)
+    cache_control = {'Cache-Control': 'private, no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={**cache_control, 'ETag': etag})
+
+    body, headers = await render({'ETag': etag})
+    if isinstance(body, bytes):
+        return Response(content=body, media_type=media_type, headers={**cache_control, **headers})
+    return StreamingResponse(body, media_type=media_type, headers={**cache_control, **headers})
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import date
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from app.database import SessionLocal, employee_department
+from app.services import CalendarService, SyncTokenExpired
+
+logger = logging.getLogger(__name__)
+
+# Включить push изменений календаря (GET /calendar/live, Server-Sent Events)
+CALENDAR_LIVE = os.getenv('CALENDAR_LIVE', 'false').lower() in ('1', 'true', 'yes')
+CALENDAR_LIVE_BATCH = float(os.getenv('CALENDAR_LIVE_BATCH', '0.2'))  # секунд: изменения за окно уходят одной пачкой
+CALENDAR_LIVE_QUEUE = int(os.getenv('CALENDAR_LIVE_QUEUE', '100'))  # пачек в очереди медленного клиента до сброса
+CALENDAR_LIVE_HEARTBEAT = float(os.getenv('CALENDAR_LIVE_HEARTBEAT', '15'))  # секунд между комментариями-пингами
+
+# (сотрудник, начало, конец) - где событие было или стало после изменения
+Place = Tuple[int, date, date]
+
+
+class Subscription:
+    """Окно дат и/или отдел, на которые подписан клиент, и очередь пачек для него"""
+
+    def __init__(self, since: str, start_date: Optional[date], end_date: Optional[date], department_id: Optional[int]):
+        self.since = since
+        self.start_date = start_date
+        self.end_date = end_date
+        self.department_id = department_id
+        # JSON пачки; None - клиент не успевал читать, ему нужно перечитать календарь
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=CALENDAR_LIVE_QUEUE)
+        self.overflowed = False
+
+    def wants(self, places: List[Place], departments: Dict[int, Set[int]]) -> bool:
+        # Место события неизвестно - изменение получают все
+        if not places:
+            return True
+        for employee_id, start, end in places:
+            if self.start_date is not None and (end < self.start_date or start > self.end_date):
+                continue
+            if self.department_id is not None and self.department_id not in departments.get(employee_id, ()):
+                continue
+            return True
+        return False
+
+    def push(self, message: Optional[str]):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+def _places(row) -> List[Place]:
+    places = []
+    if row.op != 'delete':
+        places.append((row.employee_id, row.start_date, row.end_date))
+    if row.first_old_employee_id is not None:
+        places.append((row.first_old_employee_id, row.first_old_start_date, row.first_old_end_date))
+    if row.old_employee_id is not None:
+        places.append((row.old_employee_id, row.old_start_date, row.old_end_date))
+    return places
+
+
+class CalendarLive:
+    """
+    Рассылка изменений календаря подписчикам воркера.
+
+    Воркер сам читает журнал event_changes от своего токена до текущего
+    снимка - так же, как /calendar/changes. Будит его NOTIFY триггеров events,
+    поэтому изменения с любого воркера (и в обход API) доходят до всех
+    подписчиков; уведомления за CALENDAR_LIVE_BATCH секунд сливаются в один
+    запрос и одну пачку на клиента
+    """
+
+    def __init__(self):
+        self.token: Optional[str] = None
+        self._subscriptions: Set[Subscription] = set()
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def stream(self, subscription: Subscription) -> AsyncIterator[str]:
+        """
+        Поток Server-Sent Events: первой идёт дельта от токена клиента,
+        дальше - пачки изменений по мере поступления
+        """
+        try:
+            try:
+                await self._flush(joining=subscription)
+            except ValueError:
+                yield 'event: reset\ndata: {}\n\n'
+                return
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), CALENDAR_LIVE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                if message is None:
+                    yield 'event: reset\ndata: {}\n\n'
+                    return
+                yield f'event: changes\ndata: {message}\n\n'
+        finally:
+            self._subscriptions.discard(subscription)
+
+    # -- Уведомления --
+
+    def handle_notification(self, payload: str):
+        """Уведомление notify_response_cache: интересны только изменения events"""
+        if json.loads(payload).get('table') == 'events':
+            self.schedule()
+
+    async def on_connect(self):
+        # Уведомления за время обрыва LISTEN потеряны, но журнал читается от токена
+        self.schedule()
+
+    def schedule(self):
+        # Пока идёт подписка, нового клиента ещё нет в _subscriptions
+        if self._flush_task is None and (self._subscriptions or self._lock.locked()):
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(CALENDAR_LIVE_BATCH)
+        # Уведомления, пришедшие во время чтения, запланируют следующую пачку
+        self._flush_task = None
+        try:
+            await self._flush()
+        except Exception:
+            logger.exception("Calendar live flush failed")
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        for subscription in list(self._subscriptions):
+            subscription.push(None)
+
+    # -- Рассылка --
+
+    async def _flush(self, joining: Optional[Subscription] = None):
+        """
+        Читает изменения от токена воркера до текущего снимка и раздаёт их.
+        Новый подписчик получает дельту от своего токена до того же снимка,
+        поэтому следующие пачки для него всегда новее уже полученного
+        """
+        async with self._lock:
+            async with SessionLocal() as db:
+                token = await CalendarService.current_snapshot(db)
+                batch = []
+                if self.token is not None and self._subscriptions:
+                    try:
+                        batch = await CalendarService.load_changes(db, self.token, token)
+                    except SyncTokenExpired:
+                        # Воркер отстал дольше срока хранения журнала: подписчики перечитывают календарь
+                        for subscription in list(self._subscriptions):
+                            subscription.push(None)
+                        self._subscriptions.clear()
+                catch_up = await CalendarService.load_changes(db, joining.since, token) if joining else []
+                departments = await self._departments(db, batch + catch_up, joining)
+
+            self.token = token
+            if batch:
+                self._fan_out(token, batch, departments, self._subscriptions)
+            if joining is not None:
+                self._fan_out(token, catch_up, departments, [joining], always=True)
+                self._subscriptions.add(joining)
+
+    async def _departments(self, db, rows, joining: Optional[Subscription]) -> Dict[int, Set[int]]:
+        """Отделы сотрудников из пачки - только если кто-то подписан на отдел"""
+        subscriptions = self._subscriptions | ({joining} if joining else set())
+        if not rows or all(subscription.department_id is None for subscription in subscriptions):
+            return {}
+        employee_ids = {place[0] for row in rows for place in _places(row)}
+        departments: Dict[int, Set[int]] = {}
+        for employee_id, department_id in (await db.execute(
+            select(employee_department.c.employee_id, employee_department.c.department_id)
+            .where(employee_department.c.employee_id.in_(employee_ids))
+        )).all():
+            departments.setdefault(employee_id, set()).add(department_id)
+        return departments
+
+    @staticmethod
+    def _fan_out(token: str, rows, departments: Dict[int, Set[int]], subscriptions, always: bool = False):
+        # Каждое изменение сериализуется один раз, для клиента склеиваются нужные
+        items = [(CalendarService.change_item(row).model_dump_json(), _places(row)) for row in rows]
+        prefix = '{"token":' + json.dumps(token) + ',"changes":['
+        for subscription in list(subscriptions):
+            selected = [item for item, places in items if subscription.wants(places, departments)]
+            if selected or always:
+                subscription.push(prefix + ','.join(selected) + ']}')
+
+
+calendar_live = CalendarLive()
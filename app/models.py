@@ -1,7 +1,7 @@
-from datetime import date
+from datetime import date, datetime
 from typing import List
 from pydantic import BaseModel, RootModel
-from typing import Literal, Optional
+from typing import Any, Dict, Literal, Optional, Tuple
 
 class EmployeeInfo(BaseModel):
     id: int
@@ -59,6 +59,18 @@ class CreateCalendarEvent(BaseModel):
 class CreateCalendarEventResponse(BaseModel):
     id: int
 
+class CreateCalendarEventsBatch(BaseModel):
+    events: List[CreateCalendarEvent]
+
+class CreateCalendarEventResult(BaseModel):
+    index: int  # позиция события в запросе
+    id: Optional[int] = None  # id созданного события; пусто, если оно не прошло проверку
+    error: Optional[str] = None
+
+class CreateCalendarEventsBatchResponse(BaseModel):
+    created: int
+    results: List[CreateCalendarEventResult]
+
 
 # Response models
 class CalendarResponseItem(BaseModel):
@@ -75,6 +87,57 @@ class WorkloadResponse(BaseModel):
     employees: List[WorkloadResponseItem]
     total: List[DailyWorkload]
 
+
+# Компактные формы /workload: дни вне [start, start + длина ряда) имеют нулевую загрузку
+class WorkloadSeries(BaseModel):
+    start: date
+    percents: List[float]
+
+
+class WorkloadSeriesItem(BaseModel):
+    employee: EmployeeInfo
+    start: date
+    percents: List[float]
+
+
+class WorkloadSeriesResponse(BaseModel):
+    start_date: date
+    end_date: date
+    employees: List[WorkloadSeriesItem]
+    total: WorkloadSeries
+
+
+class WorkloadRuns(BaseModel):
+    start: date
+    runs: List[Tuple[float, int]]  # (процент, сколько дней подряд)
+
+
+class WorkloadRunsItem(BaseModel):
+    employee: EmployeeInfo
+    start: date
+    runs: List[Tuple[float, int]]
+
+
+class WorkloadRunsResponse(BaseModel):
+    start_date: date
+    end_date: date
+    employees: List[WorkloadRunsItem]
+    total: WorkloadRuns
+
+class CalendarChange(BaseModel):
+    id: int
+    deleted: bool = False  # событие удалено, остальные поля пустые
+    employee: Optional[EmployeeInfo] = None
+    type: Optional[Literal['vacation', 'business_trip']] = None
+    start: Optional[date] = None
+    end: Optional[date] = None
+    level: Optional[str] = None
+
+
+class CalendarChangesResponse(BaseModel):
+    token: str  # передать в since при следующем запросе
+    changes: List[CalendarChange]
+
 class DepartmentInfo(BaseModel):
     id: int
     name: str
@@ -93,3 +156,25 @@ class GetemployeeResponse(RootModel):
 class AuthToken(BaseModel):
     auth_token: str
     app_name: str
+
+
+class SyncJobCreatedResponse(BaseModel):
+    job_id: str
+    status: str
+
+class BitrixEventResponse(BaseModel):
+    accepted: bool
+
+class SyncJobResponse(BaseModel):
+    id: str
+    trigger: Literal['manual', 'scheduled']
+    status: Literal['queued', 'running', 'success', 'failed', 'skipped']
+    stage: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    timings: Optional[Dict[str, float]] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    model_config = {'from_attributes': True}
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+from app.database import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# asyncpg.connect понимает обычный postgresql:// URL без имени драйвера
+LISTEN_DSN = DATABASE_URL.set(drivername='postgresql').render_as_string(hide_password=False)
+
+
+class PgListener:
+    """
+    Отдельное соединение asyncpg для LISTEN: раздаёт уведомления Postgres
+    подписчикам каналов. При обрыве переподключается; уведомления за время
+    обрыва теряются, поэтому при обрыве вызываются обработчики on_disconnect
+    (кэш перестаёт отвечать), а после каждого подключения - on_connect
+    (например, полная перезагрузка кэша)
+    """
+
+    def __init__(self, dsn: str = LISTEN_DSN, reconnect_delay: float = 1.0):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self._handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self._on_connect: List[Callable[[], Awaitable[None]]] = []
+        self._on_disconnect: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._conn: Optional[asyncpg.Connection] = None
+        self._lock = asyncio.Lock()
+
+    def subscribe(self, channel: str, handler: Callable[[str], None]):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def on_connect(self, handler: Callable[[], Awaitable[None]]):
+        self._on_connect.append(handler)
+
+    def on_disconnect(self, handler: Callable[[], None]):
+        self._on_disconnect.append(handler)
+
+    def start(self):
+        if self._task is None and self._handlers:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def barrier(self):
+        """
+        Дожидается рассылки уведомлений от транзакций, закоммиченных до вызова:
+        Postgres отправляет их слушающему соединению не позже ответа на запрос
+        """
+        conn = self._conn
+        if conn is None or conn.is_closed():
+            return
+        async with self._lock:
+            await conn.execute('SELECT 1')
+
+    def _dispatch(self, connection, pid, channel, payload):
+        for handler in self._handlers.get(channel, []):
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception("Failed to handle notification on %s", channel)
+
+    async def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _: closed.set())
+                for channel in self._handlers:
+                    await conn.add_listener(channel, self._dispatch)
+                # Подписались - теперь можно перечитать состояние, ничего не пропустив
+                for handler in self._on_connect:
+                    await handler()
+                self._conn = conn
+                await closed.wait()
+                logger.warning("LISTEN connection closed, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN connection failed, reconnecting")
+            finally:
+                self._conn = None
+                for handler in self._on_disconnect:
+                    try:
+                        handler()
+                    except Exception:
+                        logger.exception("LISTEN disconnect handler failed")
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(self.reconnect_delay)
+
+
+pg_listener = PgListener()
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Кэш готовых JSON-ответов /calendar и /workload: off, local или redis
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', 'off').lower()
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '3600'))  # секунд, страховка от пропущенной инвалидации
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Канал NOTIFY, в который триггеры events/daily_workloads/employees пишут изменённые диапазоны дат
+RESPONSE_CACHE_CHANNEL = 'response_cache'
+
+# Какие ответы зависят от какой таблицы
+TABLE_KINDS = {
+    'events': ('calendar',),
+    'daily_workloads': ('workload',),
+}
+KINDS = ('calendar', 'workload')
+
+
+def cache_key(kind: str, start_date: date, end_date: date, filters: Dict[str, object]) -> str:
+    return f'{kind}:{start_date.isoformat()}:{end_date.isoformat()}:{json.dumps(filters, sort_keys=True)}'
+
+
+class LocalBackend:
+    """LRU в памяти воркера, ограниченный суммарным размером ответов"""
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.epoch = 0
+        self._entries: "OrderedDict[str, Tuple[bytes, str, int, int]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    async def get_epoch(self) -> int:
+        return self.epoch
+
+    async def set(self, key: str, kind: str, start: int, end: int, body: bytes, epoch: int):
+        # За время построения ответа данные могли измениться - такой ответ не кэшируем
+        if epoch != self.epoch or len(body) > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = (body, kind, start, end)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    async def invalidate(self, kinds: Iterable[str], start: Optional[int], end: Optional[int]) -> int:
+        self.epoch += 1
+        kinds = set(kinds)
+        stale = [
+            key for key, (_, kind, entry_start, entry_end) in self._entries.items()
+            if kind in kinds and (start is None or (entry_start <= end and entry_end >= start))
+        ]
+        for key in stale:
+            self._drop(key)
+        return len(stale)
+
+    async def stats(self) -> dict:
+        return {'backend': 'local', 'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes}
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[0])
+
+
+class RedisBackend:
+    """
+    Кэш в Redis (или любом сервере с протоколом Redis), общий для всех
+    воркеров. Ограничение по памяти и вытеснение LRU задаются на сервере
+    (maxmemory, maxmemory-policy allkeys-lru). Для инвалидации по диапазону
+    ключи каждого вида лежат в sorted set: в члене записаны начало и конец
+    диапазона, score - время истечения записи. Истёкшие члены убираются
+    ZREMRANGEBYSCORE при каждой записи и инвалидации, поэтому индекс не
+    растёт дальше живых записей, даже если сам ключ индекса не истекает
+    """
+
+    def __init__(self, client=None, prefix: str = 'calendar-api:response', ttl: int = RESPONSE_CACHE_TTL):
+        if client is None:
+            import redis.asyncio
+            client = redis.asyncio.from_url(REDIS_URL)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _index(self, kind: str) -> str:
+        return f'{self.prefix}:index:{kind}'
+
+    def _trim(self, pipe, kind: str):
+        pipe.zremrangebyscore(self._index(kind), '-inf', time.time())
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(f'{self.prefix}:{key}')
+
+    async def get_epoch(self) -> int:
+        return int(await self.client.get(f'{self.prefix}:epoch') or 0)
+
+    async def set(self, key: str, kind: str, start: int, end: int, body: bytes, epoch: int):
+        from redis.exceptions import WatchError
+
+        epoch_key = f'{self.prefix}:epoch'
+        async with self.client.pipeline(transaction=True) as pipe:
+            # WATCH: если между чтением epoch и записью прошла инвалидация, запись отменится
+            await pipe.watch(epoch_key)
+            if int(await pipe.get(epoch_key) or 0) != epoch:
+                await pipe.reset()
+                return
+            pipe.multi()
+            pipe.set(f'{self.prefix}:{key}', body, ex=self.ttl)
+            self._trim(pipe, kind)
+            pipe.zadd(self._index(kind), {f'{start}|{end}|{key}': time.time() + self.ttl})
+            pipe.expire(self._index(kind), self.ttl)
+            try:
+                await pipe.execute()
+            except WatchError:
+                pass
+
+    async def invalidate(self, kinds: Iterable[str], start: Optional[int], end: Optional[int]) -> int:
+        await self.client.incr(f'{self.prefix}:epoch')
+        dropped = 0
+        for kind in kinds:
+            async with self.client.pipeline(transaction=False) as pipe:
+                self._trim(pipe, kind)
+                pipe.zrange(self._index(kind), 0, -1)
+                members = (await pipe.execute())[-1]
+            stale = []
+            for member in members:
+                member = member.decode() if isinstance(member, bytes) else member
+                entry_start, entry_end, key = member.split('|', 2)
+                if start is None or (int(entry_start) <= end and int(entry_end) >= start):
+                    stale.append((member, key))
+            if stale:
+                await self.client.delete(*(f'{self.prefix}:{key}' for _, key in stale))
+                await self.client.zrem(self._index(kind), *(member for member, _ in stale))
+                dropped += len(stale)
+        return dropped
+
+    async def stats(self) -> dict:
+        async with self.client.pipeline(transaction=False) as pipe:
+            for kind in KINDS:
+                self._trim(pipe, kind)
+                pipe.zcard(self._index(kind))
+            results = await pipe.execute()
+        return {'backend': 'redis', 'entries': sum(results[1::2])}
+
+
+class ResponseCache:
+    """
+    Кэш уже сериализованных ответов, ключ - (вид, start_date, end_date, фильтры).
+    Записи сбрасываются, когда изменения в events/daily_workloads задевают
+    их диапазон дат, а при переименовании сотрудников - целиком
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._tasks = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def get_or_render(
+        self,
+        kind: str,
+        start_date: date,
+        end_date: date,
+        filters: Dict[str, object],
+        render: Callable[[], Awaitable[bytes]],
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[bytes, Dict[str, str]]:
+        """
+        Тело ответа и заголовки (ETag, X-Sync-Token), с которыми оно было
+        построено. Уведомление об изменении может прийти чуть позже новых
+        заголовков, поэтому при попадании возвращаются заголовки из записи,
+        а не переданные: клиент не запомнит старое тело под новым ETag.
+        Запись с другим ETag считается промахом: версии таблиц меняются и от
+        изменений вне её диапазона дат, которые запись не сбрасывают, и с
+        устаревшим ETag клиент никогда не получил бы 304
+        """
+        headers = headers or {}
+        if self.backend is None:
+            return await render(), headers
+
+        key = cache_key(kind, start_date, end_date, filters)
+        entry = await self.backend.get(key)
+        if entry is not None:
+            stored_headers, _, body = entry.partition(b'\n')
+            stored_headers = json.loads(stored_headers)
+            if stored_headers.get('ETag') == headers.get('ETag'):
+                self.hits += 1
+                return body, stored_headers
+
+        self.misses += 1
+        epoch = await self.backend.get_epoch()
+        body = await render()
+        entry = json.dumps(headers).encode() + b'\n' + body
+        await self.backend.set(key, kind, start_date.toordinal(), end_date.toordinal(), entry, epoch)
+        return body, headers
+
+    async def invalidate(self, kinds: Iterable[str], start_date: Optional[date] = None, end_date: Optional[date] = None):
+        """Сбрасывает ответы видов kinds, пересекающиеся с [start_date, end_date]; без дат - все"""
+        if self.backend is None:
+            return 0
+        if start_date is None or end_date is None:
+            return await self.backend.invalidate(kinds, None, None)
+        return await self.backend.invalidate(kinds, start_date.toordinal(), end_date.toordinal())
+
+    async def clear(self):
+        await self.invalidate(KINDS)
+
+    def handle_notification(self, payload: str):
+        """Уведомление триггера notify_response_cache: инвалидация в фоне"""
+        message = json.loads(payload)
+        kinds = TABLE_KINDS.get(message['table'], KINDS)
+        start = message.get('start')
+        end = message.get('end')
+        task = asyncio.create_task(self.invalidate(
+            kinds,
+            date.fromisoformat(start) if start else None,
+            date.fromisoformat(end) if end else None,
+        ))
+        self._tasks.add(task)
+        task.add_done_callback(self._invalidation_done)
+
+    def _invalidation_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Response cache invalidation failed", exc_info=task.exception())
+
+    async def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+        if self.backend is not None:
+            stats.update(await self.backend.stats())
+        return stats
+
+
+def _make_backend():
+    if RESPONSE_CACHE == 'local':
+        return LocalBackend()
+    if RESPONSE_CACHE == 'redis':
+        return RedisBackend()
+    return None
+
+
+response_cache = ResponseCache(_make_backend())
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import select, update, func
+
+from app.database import SessionLocal, SyncJob, engine
+from app.services import BitrixService, CalendarService, EVENT_CHANGES_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Период фоновой синхронизации с битриксом, секунд. 0 - только по запросу
+BITRIX_SYNC_INTERVAL = int(os.getenv('BITRIX_SYNC_INTERVAL', '0'))
+
+# Период очистки журнала event_changes, секунд
+EVENT_CHANGES_PRUNE_INTERVAL = int(os.getenv('EVENT_CHANGES_PRUNE_INTERVAL', '3600'))
+
+# Ключ advisory-блокировки: синхронизацию выполняет только один воркер на все реплики
+BITRIX_SYNC_LOCK_KEY = 0x42_1724_5C
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class SyncScheduler:
+    """
+    Фоновый планировщик синхронизации с битриксом.
+
+    PATCH /data ставит задачу в очередь и сразу возвращает её id, статус
+    задачи хранится в таблице sync_jobs и виден с любой реплики. Если
+    задан BITRIX_SYNC_INTERVAL, синхронизация дополнительно запускается
+    по расписанию
+    """
+
+    def __init__(self, interval: int = BITRIX_SYNC_INTERVAL):
+        self.interval = interval
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._pending_job_id: Optional[str] = None
+        self._pending_force = False
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def enqueue(self, force: bool = False) -> SyncJob:
+        """
+        Ставит синхронизацию в очередь. Если задача уже ждёт в очереди
+        этого воркера (и она не слабее запрошенной), возвращает её, а не создаёт новую.
+        force=True - полная сверка без учёта сохранённых хэшей
+        """
+        if self._pending_job_id is not None and (self._pending_force or not force):
+            job = await self.get_job(self._pending_job_id)
+            if job is not None and job.status == 'queued':
+                return job
+
+        async with SessionLocal() as db:
+            job = SyncJob(id=str(uuid.uuid4()), trigger='manual', status='queued', created_at=_now())
+            db.add(job)
+            await db.commit()
+
+        self._pending_job_id = job.id
+        self._pending_force = force
+        self._queue.put_nowait((job.id, force))
+        return job
+
+    @staticmethod
+    async def get_job(job_id: str) -> Optional[SyncJob]:
+        async with SessionLocal() as db:
+            return await db.get(SyncJob, job_id)
+
+    async def _run(self):
+        while True:
+            try:
+                if self.interval > 0:
+                    job_id, force = await asyncio.wait_for(self._queue.get(), timeout=self.interval)
+                else:
+                    job_id, force = await self._queue.get()
+            except asyncio.TimeoutError:
+                job_id, force = None, False
+
+            if job_id == self._pending_job_id:
+                self._pending_job_id = None
+                self._pending_force = False
+
+            try:
+                await self._execute(job_id, force)
+            except Exception:
+                logger.exception("Bitrix sync job %s failed", job_id)
+
+    async def _execute(self, job_id: Optional[str], force: bool = False):
+        """
+        Выполняет задачу job_id; без job_id - плановый запуск, для которого
+        запись в sync_jobs создаётся, только если удалось взять блокировку
+        """
+        async with engine.connect() as lock_conn:
+            locked = await lock_conn.scalar(select(func.pg_try_advisory_lock(BITRIX_SYNC_LOCK_KEY)))
+            # Блокировка сессионная, держать открытую транзакцию не нужно
+            await lock_conn.commit()
+
+            if not locked:
+                if job_id is not None:
+                    await self._update_job(
+                        job_id,
+                        status='skipped',
+                        finished_at=_now(),
+                        error='Синхронизация уже выполняется другим воркером',
+                    )
+                return
+
+            try:
+                if job_id is None:
+                    async with SessionLocal() as db:
+                        job = SyncJob(id=str(uuid.uuid4()), trigger='scheduled', status='queued', created_at=_now())
+                        db.add(job)
+                        await db.commit()
+                    job_id = job.id
+                await self._sync(job_id, force)
+            finally:
+                await lock_conn.execute(select(func.pg_advisory_unlock(BITRIX_SYNC_LOCK_KEY)))
+                await lock_conn.commit()
+
+    async def _sync(self, job_id: str, force: bool = False):
+        await self._update_job(job_id, status='running', started_at=_now())
+
+        async def progress(stage: str):
+            await self._update_job(job_id, stage=stage)
+
+        try:
+            async with SessionLocal() as db:
+                result = await BitrixService(db).sync_with_bitrix(progress=progress, force=force)
+        except Exception as e:
+            await self._update_job(job_id, status='failed', finished_at=_now(), error=str(e))
+            raise
+
+        await self._update_job(
+            job_id,
+            status='success',
+            stage=None,
+            finished_at=_now(),
+            timings=result.pop('timings', None),
+            result=result,
+        )
+
+    @staticmethod
+    async def _update_job(job_id: str, **fields):
+        async with SessionLocal() as db:
+            await db.execute(update(SyncJob).where(SyncJob.id == job_id).values(**fields))
+            await db.commit()
+
+
+sync_scheduler = SyncScheduler()
+
+
+class ChangesRetention:
+    """
+    Фоновая очистка журнала event_changes от строк старше
+    EVENT_CHANGES_RETENTION_DAYS дней. Очистка идемпотентна, поэтому
+    её могут запускать все воркеры без блокировки
+    """
+
+    def __init__(self, interval: int = EVENT_CHANGES_PRUNE_INTERVAL, retention_days: int = EVENT_CHANGES_RETENTION_DAYS):
+        self.interval = interval
+        self.retention_days = retention_days
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.retention_days > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                async with SessionLocal() as db:
+                    deleted = await CalendarService.prune_changes(db, self.retention_days)
+                if deleted:
+                    logger.info("Pruned %d event_changes rows older than %d days", deleted, self.retention_days)
+            except Exception:
+                logger.exception("Event changes pruning failed")
+            await asyncio.sleep(self.interval)
+
+
+changes_retention = ChangesRetention()
@@ -1,65 +1,362 @@
-from datetime import date, timedelta
-from typing import List, Dict, Optional
-from app.models import GetemployeeResponse, EmployeeInfo, CreateCalendarEvent, CalendarEvent as ModelCalendarEvent, DailyWorkload as ModelDailyWorkload, CalendarResponseItem, WorkloadResponseItem, WorkloadResponse, EmployeeDepInfo
-from app.database import get_db, Employee, CalendarEvent, DailyWorkload,Department
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from datetime import date
+from itertools import groupby
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Optional, Union
+from app.models import GetemployeeResponse, EmployeeInfo, CreateCalendarEvent, CreateCalendarEventResult, CreateCalendarEventsBatchResponse, CalendarResponseItem, WorkloadResponse, WorkloadSeriesResponse, WorkloadRunsResponse, EmployeeDepInfo, CalendarChange, CalendarChangesResponse
+from app.database import get_db, SessionLocal, Employee, CalendarEvent, DailyWorkload, History, Department, employee_department, BitrixHash, EventChange, EventChangesPruned, PgSnapshot
+from app.workload import WorkloadMatrix, WORKLOAD_FORMATS, aggregate_in_sql, WORKLOAD_BLOCK_CACHE, workload_blocks
+from app.cache import TTLCache
+from app.calendar_index import calendar_index
+from app.response_cache import response_cache
+from app.notify import pg_listener
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, delete, func, literal, literal_column, tuple_, all_, any_, or_, cast, Boolean, Date, Integer, String, ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
 from app.models import CreateEmployee, CalendarEventDelete, CalendarEventUpdateDates
 from sqlalchemy import and_
-import requests
+import asyncio
+import hashlib
+import httpx
+import json
+import orjson
 import os
+import re
+import time
+from urllib.parse import urlencode
 from sqlalchemy.orm import joinedload
 
+# Коды ошибок Postgres (SQLSTATE)
+FOREIGN_KEY_VIOLATION = '23503'
+EXCLUSION_VIOLATION = '23P01'
+
+
+def _pg_error_code(error: DBAPIError) -> Optional[str]:
+    return getattr(error.orig, 'pgcode', None)
+
+
+# Токен /calendar/changes - снимок транзакций Postgres в текстовом виде: xmin:xmax:xip_list
+SYNC_TOKEN_PATTERN = re.compile(r'\d+:\d+:(\d+(,\d+)*)?')
+
+# Сколько дней хранить журнал event_changes. Токены старше уже не восстановить
+# из журнала, клиенту нужно перечитать календарь. 0 - не чистить
+EVENT_CHANGES_RETENTION_DAYS = int(os.getenv('EVENT_CHANGES_RETENTION_DAYS', '30'))
+
+
+class SyncTokenExpired(ValueError):
+    """Токен снят до очищенной части журнала event_changes"""
+
+
+# Сколько строк отправлять в одном INSERT при синхронизации с битриксом
+SYNC_CHUNK_SIZE = 1000
+
+# Сколько строк календаря забирать с серверного курсора за раз в режиме NDJSON
+CALENDAR_STREAM_CHUNK = 1000
+
+# Сколько событий можно создать одним POST /events:batch
+EVENTS_BATCH_MAX = int(os.getenv('EVENTS_BATCH_MAX', '5000'))
+
+# Настройки клиента битрикса
+BITRIX_URL = os.getenv('BITRIX_URL', 'https://tandem-consult.ru/rest/516')
+BITRIX_MAX_WORKERS = int(os.getenv('BITRIX_MAX_WORKERS', '8'))  # одновременных запросов страниц
+BITRIX_TIMEOUT = float(os.getenv('BITRIX_TIMEOUT', '30'))
+BITRIX_RETRIES = int(os.getenv('BITRIX_RETRIES', '3'))
+BITRIX_BACKOFF = float(os.getenv('BITRIX_BACKOFF', '0.5'))  # секунд, удваивается с каждой попыткой
+BITRIX_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# batch-режим: страницы упаковываются в вызовы batch, до 50 команд в каждом
+BITRIX_BATCH = os.getenv('BITRIX_BATCH', 'false').lower() in ('1', 'true', 'yes')
+BITRIX_BATCH_SIZE = min(int(os.getenv('BITRIX_BATCH_SIZE', '50')), 50)
+
+
+# Сервис авторизации
+AUTH_SERVICE_URL = os.getenv('AUTH_SERVICE_URL', 'http://10.100.50.37:8125')
+AUTH_TIMEOUT = float(os.getenv('AUTH_TIMEOUT', '5'))
+AUTH_MAX_CONNECTIONS = int(os.getenv('AUTH_MAX_CONNECTIONS', '20'))
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '60'))  # секунд для подтверждённых ролей
+AUTH_NEGATIVE_TTL = float(os.getenv('AUTH_NEGATIVE_TTL', '10'))  # секунд для отклонённых токенов
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+AUTH_REJECT_STATUSES = {401, 403, 404}
+
+
+def _bitrix_query(params: dict, prefix: str = '') -> str:
+    """
+    Кодирует параметры в строку запроса для команды batch так же,
+    как это делает PHP http_build_query (вложенные ключи - FILTER[ID][0])
+    """
+    pairs = []
+    items = params.items() if isinstance(params, dict) else enumerate(params)
+    for key, value in items:
+        name = f'{prefix}[{key}]' if prefix else str(key)
+        if isinstance(value, (dict, list, tuple)):
+            nested = _bitrix_query(value, name)
+            if nested:
+                pairs.append(nested)
+        elif isinstance(value, bool):
+            pairs.append(urlencode({name: int(value)}))
+        elif value is not None:
+            pairs.append(urlencode({name: value}))
+    return '&'.join(pairs)
+
+
+def _without_history():
+    """
+    Условие на сотрудника без событий, загрузки и истории. Сотрудника, пропавшего
+    из битрикса, удаляем только так: иначе мешают внешние ключи, а календарь
+    за прошлые периоды терять нельзя. С историей он остаётся в базе без отделов
+    """
+    return and_(
+        ~select(CalendarEvent.id).where(CalendarEvent.employee_id == Employee.id).exists(),
+        ~select(DailyWorkload.id).where(DailyWorkload.employee_id == Employee.id).exists(),
+        ~select(History.id).where(or_(History.employee_id == Employee.id, History.participant_id == Employee.id)).exists(),
+    )
+
+
+def _record_hash(record: dict) -> str:
+    """Стабильный хэш записи: не зависит от порядка ключей"""
+    payload = json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def _payload_hash(hashes: Dict[str, Dict[int, str]]) -> str:
+    """Хэш всей выгрузки по хэшам записей"""
+    digest = hashlib.sha1()
+    for entity in sorted(hashes):
+        for record_id in sorted(hashes[entity]):
+            digest.update(f'{entity}:{record_id}:{hashes[entity][record_id]};'.encode())
+    return digest.hexdigest()
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
 class CalendarService:
     @staticmethod
-    def get_calendar(db: Session, start_date: date, end_date: date) -> List[CalendarResponseItem]:
+    async def get_calendar(db: AsyncSession, start_date: date, end_date: date) -> List[CalendarResponseItem]:
         """
         Get calendar events for the specified date range from the database
         """
+        return [
+            CalendarResponseItem.model_validate(item)
+            for item in await CalendarService._calendar_items(db, start_date, end_date)
+        ]
+
+    @staticmethod
+    async def get_calendar_json(db: AsyncSession, start_date: date, end_date: date) -> bytes:
+        """То же, что get_calendar, но сразу JSON: без модели pydantic на каждое событие"""
+        return orjson.dumps(await CalendarService._calendar_items(db, start_date, end_date))
+
+    @staticmethod
+    async def _calendar_items(db: AsyncSession, start_date: date, end_date: date) -> List[dict]:
         if start_date > end_date:
             raise ValueError("Start date cannot be after end date")
-        
-        # Query events that overlap with the date range
-        db_events = db.query(CalendarEvent).filter(
-            and_(
-                CalendarEvent.start_date <= end_date,
-                CalendarEvent.end_date >= start_date
+
+        # С включённым CALENDAR_INDEX отвечаем из памяти воркера
+        if calendar_index.ready:
+            result = calendar_index.calendar_items(start_date, end_date)
+            if result is not None:
+                return result
+
+        db_rows = (await db.execute(CalendarService._calendar_query(start_date, end_date))).all()
+
+        # Group events by employee (rows are already sorted by employee)
+        return [
+            CalendarService._calendar_item(employee_id, full_name, rows)
+            for (employee_id, full_name), rows in groupby(db_rows, key=lambda row: (row[0], row[1]))
+        ]
+
+    @staticmethod
+    def _calendar_query(start_date: date, end_date: date):
+        # Query events that overlap with the date range together with their
+        # employees in a single round trip, ordered so that grouping is linear
+        return (
+            select(
+                Employee.id,
+                Employee.full_name,
+                CalendarEvent.id,
+                CalendarEvent.event_type,
+                CalendarEvent.start_date,
+                CalendarEvent.end_date,
+                CalendarEvent.level,
             )
-        ).all()
-        
-        result = []
-        
-        # Group events by employee
-        employee_events = {}
-        for event in db_events:
-            employee = event.employee
-            if employee.id not in employee_events:
-                employee_events[employee.id] = {
-                    'employee': EmployeeInfo(id=employee.id, full_name=employee.full_name),
-                    'events': []
+            .join(CalendarEvent.employee)
+            .where(CalendarEvent.period.overlaps(func.daterange(start_date, end_date, '[]')))
+            .order_by(Employee.id, CalendarEvent.start_date, CalendarEvent.id)
+        )
+
+    @staticmethod
+    def _calendar_item(employee_id: int, full_name: str, rows) -> dict:
+        """Элемент ответа /calendar простыми словарями, в порядке полей CalendarResponseItem"""
+        return {
+            'employee': {'id': employee_id, 'full_name': full_name},
+            'events': [
+                {
+                    'id': event_id,
+                    'type': event_type,
+                    'start': event_start,
+                    'end': event_end,
+                    'level': level,
                 }
-            
-            # Convert database event to model event
-            model_event = ModelCalendarEvent(
-                id=event.id,
-                type=event.event_type,
-                start=event.start_date,
-                end=event.end_date,
-                level = event.level,
+                for _, _, event_id, event_type, event_start, event_end, level in rows
+            ],
+        }
+
+    @staticmethod
+    def stream_calendar(start_date: date, end_date: date) -> AsyncIterator[bytes]:
+        """
+        Календарь в формате NDJSON: строка на сотрудника. Строки читаются
+        серверным курсором порциями по CALENDAR_STREAM_CHUNK, и строка
+        сотрудника отправляется, как только прочитаны все его события
+        """
+        if start_date > end_date:
+            raise ValueError("Start date cannot be after end date")
+        return CalendarService._calendar_lines(start_date, end_date)
+
+    @staticmethod
+    async def _calendar_lines(start_date: date, end_date: date) -> AsyncIterator[bytes]:
+        # Своя сессия: поток читается уже после выхода из обработчика маршрута
+        async with SessionLocal() as db:
+            result = await db.stream(
+                CalendarService._calendar_query(start_date, end_date).execution_options(yield_per=CALENDAR_STREAM_CHUNK)
             )
-            employee_events[employee.id]['events'].append(model_event)
-        
-        # Create response items
-        for emp_data in employee_events.values():
-            result.append(CalendarResponseItem(
-                employee=emp_data['employee'],
-                events=emp_data['events']
-            ))
-        
-        return result
+            employee = None
+            rows = []
+            # Строки готовых сотрудников отправляются одним куском на порцию курсора
+            async for partition in result.partitions():
+                lines = []
+                for row in partition:
+                    if employee is not None and row[0] != employee[0]:
+                        lines.append(orjson.dumps(CalendarService._calendar_item(*employee, rows)))
+                        rows = []
+                    employee = (row[0], row[1])
+                    rows.append(row)
+                if lines:
+                    yield b'\n'.join(lines) + b'\n'
+            if employee is not None:
+                yield orjson.dumps(CalendarService._calendar_item(*employee, rows)) + b'\n'
 
     @staticmethod
-    def create_event(db: Session, event_data: CreateCalendarEvent) -> CalendarEvent:
+    async def current_snapshot(db: AsyncSession) -> str:
+        return await db.scalar(select(cast(func.pg_current_snapshot(), String)))
+
+    @staticmethod
+    async def sync_token(db: AsyncSession) -> str:
+        """
+        Токен для /calendar/changes - снимок транзакций на момент вызова.
+        Брать до чтения календаря: изменения, попавшие между токеном и
+        чтением, придут в дельте ещё раз, но не потеряются
+        """
+        token = await CalendarService.current_snapshot(db)
+        if calendar_index.ready:
+            # Индекс должен успеть применить всё, что видно в снимке
+            await pg_listener.barrier()
+        return token
+
+    @staticmethod
+    async def load_changes(db: AsyncSession, since: str, token: str):
+        """
+        Строки журнала event_changes между снимками since и token - последняя
+        запись по каждому событию. first_old_* - сотрудник и даты события до
+        первого изменения в этом промежутке
+        """
+        if not SYNC_TOKEN_PATTERN.fullmatch(since):
+            raise ValueError("Некорректный токен синхронизации")
+
+        since_snapshot = cast(literal(since, String), PgSnapshot)
+        snapshot = cast(literal(token, String), PgSnapshot)
+        first = dict(partition_by=EventChange.event_id, order_by=EventChange.id)
+        try:
+            rows = (await db.execute(
+                select(
+                    EventChange.event_id,
+                    EventChange.op,
+                    EventChange.employee_id,
+                    Employee.full_name,
+                    EventChange.event_type,
+                    EventChange.start_date,
+                    EventChange.end_date,
+                    EventChange.level,
+                    EventChange.old_employee_id,
+                    EventChange.old_start_date,
+                    EventChange.old_end_date,
+                    func.first_value(EventChange.old_employee_id).over(**first).label('first_old_employee_id'),
+                    func.first_value(EventChange.old_start_date).over(**first).label('first_old_start_date'),
+                    func.first_value(EventChange.old_end_date).over(**first).label('first_old_end_date'),
+                )
+                .outerjoin(Employee, Employee.id == EventChange.employee_id)
+                .where(
+                    # Транзакции, завершённые между двумя снимками
+                    EventChange.txid >= func.pg_snapshot_xmin(since_snapshot),
+                    EventChange.txid < func.pg_snapshot_xmax(snapshot),
+                    ~func.pg_visible_in_snapshot(EventChange.txid, since_snapshot, type_=Boolean),
+                    func.pg_visible_in_snapshot(EventChange.txid, snapshot, type_=Boolean),
+                )
+                .distinct(EventChange.event_id)
+                .order_by(EventChange.event_id, EventChange.id.desc())
+            )).all()
+            # Граница читается после журнала: если очистка успела удалить нужные
+            # строки, здесь уже видна её граница
+            expired = await db.scalar(
+                select(func.pg_snapshot_xmin(since_snapshot) <= EventChangesPruned.txid)
+            )
+        except DBAPIError:
+            raise ValueError("Некорректный токен синхронизации")
+        if expired:
+            raise SyncTokenExpired("Токен синхронизации устарел, календарь нужно перечитать")
+        return rows
+
+    @staticmethod
+    def change_item(row) -> CalendarChange:
+        if row.op == 'delete':
+            return CalendarChange(id=row.event_id, deleted=True)
+        return CalendarChange(
+            id=row.event_id,
+            employee=EmployeeInfo(id=row.employee_id, full_name=row.full_name) if row.full_name is not None else None,
+            type=row.event_type,
+            start=row.start_date,
+            end=row.end_date,
+            level=row.level,
+        )
+
+    @staticmethod
+    async def get_changes(db: AsyncSession, since: str) -> CalendarChangesResponse:
+        """
+        Изменения событий после токена since: по последней версии каждого
+        изменённого события, удалённые - с deleted=True
+        """
+        token = await CalendarService.current_snapshot(db)
+        rows = await CalendarService.load_changes(db, since, token)
+        return CalendarChangesResponse(token=token, changes=[CalendarService.change_item(row) for row in rows])
+
+    @staticmethod
+    async def prune_changes(db: AsyncSession, retention_days: int = EVENT_CHANGES_RETENTION_DAYS) -> int:
+        """
+        Удаляет из журнала event_changes строки старше retention_days дней.
+        Удаляется всё до наибольшего txid старых строк, эта граница
+        сохраняется в event_changes_pruned: по ней load_changes узнаёт
+        устаревшие токены. Возвращает число удалённых строк
+        """
+        horizon = (
+            select(func.max(EventChange.txid))
+            .where(EventChange.changed_at < func.now() - func.make_interval(0, 0, 0, retention_days))
+            .scalar_subquery()
+        )
+        mark = pg_insert(EventChangesPruned).from_select(
+            ['id', 'txid'], select(literal(1), horizon).where(horizon.is_not(None)),
+        )
+        await db.execute(mark.on_conflict_do_update(
+            index_elements=[EventChangesPruned.id],
+            set_={'txid': func.greatest(EventChangesPruned.txid, mark.excluded.txid), 'pruned_at': func.now()},
+        ))
+        # Удаляется по сохранённой границе, а не по заново посчитанной
+        result = await db.execute(
+            delete(EventChange).where(EventChange.txid <= select(EventChangesPruned.txid).scalar_subquery())
+        )
+        await db.commit()
+        return result.rowcount
+
+    @staticmethod
+    async def create_event(db: AsyncSession, event_data: CreateCalendarEvent) -> CalendarEvent:
         """
         Create a new calendar event in the database
         """
@@ -67,76 +364,205 @@ class CalendarService:
         if event_data.start > event_data.end:
             raise ValueError("Start date cannot be after end date")
         
-        employee = db.query(Employee).filter(Employee.id == event_data.employee_id).first()
-        if not employee:
-            raise ValueError("Сотрудник с указанным ID не найден")
-
-        # Check for overlapping events for the same employee
-        existing_events = db.query(CalendarEvent).filter(
-            and_(
-                CalendarEvent.employee_id == event_data.employee_id,
-                CalendarEvent.start_date <= event_data.end,
-                CalendarEvent.end_date >= event_data.start,
-                CalendarEvent.level == 'approved',
-            )
-        ).all()
-
-        if existing_events:
-            raise ValueError(f"У сотрудника уже есть согласованное событие между {event_data.start} и {event_data.end}")
-
-        # Create new event
-        db_event = CalendarEvent(
-            employee_id=event_data.employee_id,
-            event_type=event_data.type,
-            start_date=event_data.start,
-            end_date=event_data.end,
-            level=event_data.level,
-        )
+        overlap_error = f"У сотрудника уже есть согласованное событие между {event_data.start} и {event_data.end}"
+
+        # Индекс в памяти позволяет отказать без обращения к базе;
+        # если пересечения в нём нет, окончательно решает вставка ниже
+        if calendar_index.ready and calendar_index.has_approved_overlap(
+            event_data.employee_id, event_data.start, event_data.end
+        ):
+            raise ValueError(overlap_error)
+
+        # Одна вставка вместо SELECT + INSERT: строка не вставится, если у сотрудника
+        # есть пересекающееся согласованное событие. Гонку двух согласованных событий
+        # закрывает ограничение events_approved_no_overlap, несуществующего
+        # сотрудника - внешний ключ
+        has_approved_overlap = select(CalendarEvent.id).where(
+            CalendarEvent.employee_id == event_data.employee_id,
+            CalendarEvent.level == 'approved',
+            CalendarEvent.period.overlaps(func.daterange(event_data.start, event_data.end, '[]')),
+        ).exists()
+
+        insert_event = insert(CalendarEvent).from_select(
+            ['employee_id', 'event_type', 'start_date', 'end_date', 'level'],
+            select(
+                literal(event_data.employee_id),
+                literal(event_data.type),
+                literal(event_data.start, Date),
+                literal(event_data.end, Date),
+                literal(event_data.level),
+            ).where(~has_approved_overlap)
+        ).returning(CalendarEvent)
+
+        try:
+            db_event = (await db.scalars(insert_event)).first()
+        except IntegrityError as e:
+            await db.rollback()
+            if _pg_error_code(e) == FOREIGN_KEY_VIOLATION:
+                raise ValueError("Сотрудник с указанным ID не найден")
+            if _pg_error_code(e) == EXCLUSION_VIOLATION:
+                raise ValueError(overlap_error)
+            raise
+
+        if db_event is None:
+            await db.rollback()
+            raise ValueError(overlap_error)
 
-        db.add(db_event)
-        db.commit()
-        db.refresh(db_event)
+        await db.commit()
+        if calendar_index.ready:
+            calendar_index.put_event(
+                db_event.id, db_event.employee_id, db_event.event_type,
+                db_event.start_date, db_event.end_date, db_event.level,
+            )
+        await response_cache.invalidate(('calendar',), db_event.start_date, db_event.end_date)
 
         return db_event
+
+    @staticmethod
+    async def create_events(db: AsyncSession, events: List[CreateCalendarEvent]) -> CreateCalendarEventsBatchResponse:
+        """
+        Создание пачки событий в одной транзакции.
+
+        Каждое событие проверяется так же, как в create_event, а результат
+        совпадает с созданием событий по одному в порядке запроса: событие не
+        создаётся, если пересекается с согласованным событием сотрудника в базе
+        или с согласованным событием, принятым раньше в этой же пачке.
+        Сотрудники и пересечения с базой проверяются одним запросом на всю пачку
+        """
+        if len(events) > EVENTS_BATCH_MAX:
+            raise ValueError(f"В одной пачке не больше {EVENTS_BATCH_MAX} событий")
+
+        errors: Dict[int, str] = {}
+        for position, event_data in enumerate(events):
+            if event_data.start > event_data.end:
+                errors[position] = "Start date cannot be after end date"
+        checked = [position for position in range(len(events)) if position not in errors]
+
+        known: Dict[int, bool] = {}
+        overlapping: Dict[int, bool] = {}
+        if checked:
+            items = func.unnest(
+                literal(checked, ARRAY(Integer)),
+                literal([events[position].employee_id for position in checked], ARRAY(Integer)),
+                literal([events[position].start for position in checked], ARRAY(Date)),
+                literal([events[position].end for position in checked], ARRAY(Date)),
+            ).table_valued('position', 'employee_id', 'start_date', 'end_date').render_derived(name='items')
+            employee_exists = select(Employee.id).where(Employee.id == items.c.employee_id).exists()
+            has_approved_overlap = select(CalendarEvent.id).where(
+                CalendarEvent.employee_id == items.c.employee_id,
+                CalendarEvent.level == 'approved',
+                CalendarEvent.period.overlaps(func.daterange(items.c.start_date, items.c.end_date, '[]')),
+            ).exists()
+            for position, exists, overlaps in (await db.execute(
+                select(items.c.position, employee_exists, has_approved_overlap)
+            )).all():
+                known[position] = exists
+                overlapping[position] = overlaps
+
+        # Согласованные события, уже принятые в пачке: сотрудник -> [(начало, конец)]
+        approved: Dict[int, List[tuple]] = {}
+        accepted = []
+        for position in checked:
+            event_data = events[position]
+            if not known[position]:
+                errors[position] = "Сотрудник с указанным ID не найден"
+            elif overlapping[position] or any(
+                start <= event_data.end and event_data.start <= end
+                for start, end in approved.get(event_data.employee_id, ())
+            ):
+                errors[position] = (
+                    f"У сотрудника уже есть согласованное событие между {event_data.start} и {event_data.end}"
+                )
+            else:
+                accepted.append(position)
+                if event_data.level == 'approved':
+                    approved.setdefault(event_data.employee_id, []).append((event_data.start, event_data.end))
+
+        ids: Dict[int, int] = {}
+        if accepted:
+            rows = [
+                {
+                    'employee_id': events[position].employee_id,
+                    'event_type': events[position].type,
+                    'start_date': events[position].start,
+                    'end_date': events[position].end,
+                    'level': events[position].level,
+                }
+                for position in accepted
+            ]
+            try:
+                created = (await db.scalars(
+                    insert(CalendarEvent).returning(CalendarEvent.id, sort_by_parameter_order=True), rows,
+                )).all()
+            except IntegrityError as e:
+                # Между проверкой и вставкой события или сотрудников изменили параллельно
+                await db.rollback()
+                if _pg_error_code(e) in (FOREIGN_KEY_VIOLATION, EXCLUSION_VIOLATION):
+                    raise ValueError("Данные изменились во время создания пачки, повторите запрос")
+                raise
+            await db.commit()
+            ids = dict(zip(accepted, created))
+
+            if calendar_index.ready:
+                for position, event_id in ids.items():
+                    event_data = events[position]
+                    calendar_index.put_event(
+                        event_id, event_data.employee_id, event_data.type,
+                        event_data.start, event_data.end, event_data.level,
+                    )
+            await response_cache.invalidate(
+                ('calendar',),
+                min(events[position].start for position in accepted),
+                max(events[position].end for position in accepted),
+            )
+
+        return CreateCalendarEventsBatchResponse(
+            created=len(ids),
+            results=[
+                CreateCalendarEventResult(index=position, id=ids.get(position), error=errors.get(position))
+                for position in range(len(events))
+            ],
+        )
     
     @staticmethod
-    def delete_event(
-        db: Session, 
+    async def delete_event(
+        db: AsyncSession, 
         delete_data: CalendarEventDelete
     ) -> bool:
         """
         Удаление события календаря по ID
         """
         # Находим событие по ID
-        event = db.query(CalendarEvent).filter(
-            CalendarEvent.id == delete_data.event_id
-        ).first()
+        event = await db.get(CalendarEvent, delete_data.event_id)
         
         if not event:
             return False
         
         # Удаляем событие
-        db.delete(event)
-        db.commit()
+        await db.delete(event)
+        await db.commit()
+        if calendar_index.ready:
+            calendar_index.drop_event(delete_data.event_id)
+        await response_cache.invalidate(('calendar',), event.start_date, event.end_date)
         
         return True
     
     @staticmethod
-    def update_event(
-        db: Session, 
+    async def update_event(
+        db: AsyncSession, 
         update_data: CalendarEventUpdateDates
     ) -> CalendarEvent:
         """
         Обновление дат события календаря, возвращает обновленное событие
         """
         # Находим событие по ID
-        event = db.query(CalendarEvent).filter(
-            CalendarEvent.id == update_data.event_id
-        ).first()
+        event = await db.get(CalendarEvent, update_data.event_id)
         
         if not event:
             raise ValueError("Событие не найдено")
         
+        old_start_date, old_end_date = event.start_date, event.end_date
+
         # Определяем новые даты, используя переданные или существующие
         start_date = update_data.new_start_date or event.start_date
         end_date = update_data.new_end_date or event.end_date
@@ -154,90 +580,70 @@ class CalendarService:
             event.start_date = start_date
             event.end_date = end_date
         
-        db.commit()
-        db.refresh(event)
+        try:
+            await db.commit()
+        except IntegrityError as e:
+            await db.rollback()
+            if _pg_error_code(e) == EXCLUSION_VIOLATION:
+                raise ValueError(f"У сотрудника уже есть согласованное событие между {start_date} и {end_date}")
+            raise
+        await db.refresh(event)
+        if calendar_index.ready:
+            calendar_index.put_event(
+                event.id, event.employee_id, event.event_type,
+                event.start_date, event.end_date, event.level,
+            )
+        # Событие могло переехать: сбрасываем и старый, и новый диапазон
+        await response_cache.invalidate(
+            ('calendar',), min(old_start_date, event.start_date), max(old_end_date, event.end_date),
+        )
         
         return event
 
 class WorkloadService:
     @staticmethod
-    def get_workload(db: Session, start_date: date, end_date: date) -> WorkloadResponse:
+    async def get_workload(
+        db: AsyncSession, start_date: date, end_date: date, aggregate: str = 'python', format: str = 'dense',
+    ) -> Union[WorkloadResponse, WorkloadSeriesResponse, WorkloadRunsResponse]:
         """
         Get daily workload for employees in the specified date range from the database
+
+        aggregate='python' loads raw rows into a matrix and aggregates it in the app,
+        aggregate='sql' lets Postgres compute the zero-filled series and daily totals.
+        format='series'/'rle' returns the compact shapes instead of one item per day
         """
+        payload = await WorkloadService._payload(db, start_date, end_date, aggregate, format)
+        return WORKLOAD_FORMATS[format].model_validate(payload)
+
+    @staticmethod
+    async def get_workload_json(
+        db: AsyncSession, start_date: date, end_date: date, aggregate: str = 'python', format: str = 'dense',
+    ) -> bytes:
+        """То же, что get_workload, но сразу JSON: без модели pydantic на каждого сотрудника и день"""
+        return orjson.dumps(await WorkloadService._payload(db, start_date, end_date, aggregate, format))
+
+    @staticmethod
+    async def _payload(db: AsyncSession, start_date: date, end_date: date, aggregate: str, format: str) -> dict:
         if start_date > end_date:
             raise ValueError("Start date cannot be after end date")
-        
-        # Calculate date range
-        date_range = []
-        current_date = start_date
-        while current_date <= end_date:
-            date_range.append(current_date)
-            current_date = current_date + timedelta(days=1)
-        
-        # Get all employees with their workload entries for the date range
-        db_workloads = db.query(DailyWorkload).filter(
-            DailyWorkload.date >= start_date,
-            DailyWorkload.date <= end_date
-        ).all()
-        
-        # Group workload entries by employee
-        employee_workloads = {}
-        for workload in db_workloads:
-            employee = workload.employee
-            emp_id = employee.id
-            if emp_id not in employee_workloads:
-                employee_workloads[emp_id] = {
-                    'employee': EmployeeInfo(id=employee.id, full_name=employee.full_name),
-                    'workload': {}
-                }
-            
-            # Store workload by date
-            employee_workloads[emp_id]['workload'][workload.date] = workload.percent
-        
-        # Build response for each employee
-        employees_workload = []
-        for emp_id, emp_data in employee_workloads.items():
-            # Create workload entries for each date in range
-            workload_entries = []
-            for date_entry in date_range:
-                percent = emp_data['workload'].get(date_entry, 0.0)
-                workload_entries.append(ModelDailyWorkload(date=date_entry, percent=percent))
-            
-            # Sort by date
-            workload_entries.sort(key=lambda x: x.date)
-            
-            employees_workload.append(WorkloadResponseItem(
-                employee=emp_data['employee'],
-                workload=workload_entries
-            ))
-        
-        # Calculate total workload for each date
-        total_workload = []
-        for date_entry in date_range:
-            total_percent = 0.0
-            valid_entries = 0
-            
-            # Count valid workload entries for this date
-            for workload in db_workloads:
-                if workload.date == date_entry:
-                    total_percent += workload.percent
-                    valid_entries += 1
-            
-            if valid_entries > 0:
-                avg_percent = total_percent / valid_entries
-                total_workload.append(ModelDailyWorkload(date=date_entry, percent=avg_percent))
-            else:
-                total_workload.append(ModelDailyWorkload(date=date_entry, percent=0.0))
-        
-        # Sort total workload by date
-        total_workload.sort(key=lambda x: x.date)
-        
-        return WorkloadResponse(employees=employees_workload, total=total_workload)
+        if format not in WORKLOAD_FORMATS:
+            raise ValueError(f"Unknown workload format: {format}")
+
+        if aggregate == 'sql':
+            return await aggregate_in_sql(db, start_date, end_date, format)
+
+        # Load the range into an employees x days matrix and aggregate it in bulk;
+        # with WORKLOAD_BLOCK_CACHE the matrix is assembled from cached month blocks
+        if WORKLOAD_BLOCK_CACHE:
+            # Блоки должны успеть сброситься по уведомлениям о записях, уже
+            # учтённых в ETag: иначе старое тело уйдёт под новым ETag
+            await pg_listener.barrier()
+            return (await workload_blocks.matrix(db, start_date, end_date)).to_payload(format)
+        return (await WorkloadMatrix.load(db, start_date, end_date)).to_payload(format)
     
 class EmployeeService:
     @staticmethod
-    def create_employee(db: Session, employee_data: CreateEmployee) -> Employee:
+    async def create_employee(db: AsyncSession, employee_data: CreateEmployee) -> Employee:
         """
         METHOD IS DEPRECATED
         Создает нового сотрубника в базе данных
@@ -246,19 +652,19 @@ class EmployeeService:
             full_name=employee_data.full_name,
         )
         db.add(db_employee)
-        db.commit()
-        db.refresh(db_employee)
+        await db.commit()
+        await db.refresh(db_employee)
         return db_employee
     
     @staticmethod
-    def get_employees_with_departments(db: Session, department_id: Optional[int] = None) -> GetemployeeResponse:
-        query = db.query(Employee).options(joinedload(Employee.departments))
+    async def get_employees_with_departments(db: AsyncSession, department_id: Optional[int] = None) -> GetemployeeResponse:
+        query = select(Employee).options(joinedload(Employee.departments))
 
         if department_id is not None:
             # Фильтруем сотрудников, принадлежащих указанному отделу
-            query = query.join(Employee.departments).filter(Department.id == department_id)
+            query = query.join(Employee.departments).where(Department.id == department_id)
 
-        employees = query.all()
+        employees = (await db.execute(query)).unique().scalars().all()
 
         result = [
             EmployeeDepInfo(
@@ -273,112 +679,363 @@ class EmployeeService:
     
 class DepartmentService:
     @staticmethod
-    def get_departments(db: Session) -> List[str]:
-        data = db.query(Department).all()
+    async def get_departments(db: AsyncSession) -> List[str]:
+        data = (await db.scalars(select(Department))).all()
         return [{
             'name': item.dep_name,
             'id': item.id,
         } for item in data]
     
 class BitrixService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession, client: Optional[httpx.AsyncClient] = None):
         self.db = db
-    
-    def sync_with_bitrix(self):
-        bitrix_data = {
-            'departments': self.__fetch_departments(),
-            'employees': self.__fetch_employees(),
+        self.client = client
+
+    async def sync_with_bitrix(
+        self,
+        progress: Optional[Callable[[str], Awaitable[None]]] = None,
+        force: bool = False,
+    ):
+        """
+        Синхронизирует отделы, сотрудников и их связи с битриксом.
+        progress вызывается перед каждым этапом ('fetch', 'apply').
+
+        Изменения определяются по хэшам записей с прошлой синхронизации:
+        если выгрузка не изменилась, в базу ничего не пишется, иначе
+        обновляются только записи с другим хэшем. force=True сверяет всё заново
+        """
+        timings = {}
+
+        if progress is not None:
+            await progress('fetch')
+        started = time.perf_counter()
+        bitrix_data = await self.__fetch_bitrix_data()
+        timings['fetch'] = time.perf_counter() - started
+
+        if progress is not None:
+            await progress('apply')
+        started = time.perf_counter()
+
+        departments = {d['id']: {'dep_name': d['dep_name']} for d in bitrix_data['departments']}
+        # Связи с отделами, которых нет в битриксе, не создаём. Фильтруем до
+        # хэширования, чтобы появление или удаление отдела меняло хэш сотрудника
+        employees = {
+            e['id']: {
+                'full_name': e['full_name'].strip(),
+                'department_id': sorted({
+                    int(dep_id) for dep_id in e['department_id'] or [] if int(dep_id) in departments
+                }),
+            }
+            for e in bitrix_data['employees']
+        }
+        hashes = {
+            'department': {dep_id: _record_hash(dep) for dep_id, dep in departments.items()},
+            'employee': {emp_id: _record_hash(emp) for emp_id, emp in employees.items()},
+        }
+        payload_hash = _payload_hash(hashes)
+
+        counts = {
+            'departments': {'inserted': 0, 'updated': 0, 'deleted': 0},
+            'employees': {'inserted': 0, 'updated': 0, 'deleted': 0},
+            'links': {'inserted': 0, 'deleted': 0},
         }
 
+        stored = {'department': {}, 'employee': {}, 'payload': {}}
+        if not force:
+            for entity, record_id, record_hash in (await self.db.execute(
+                select(BitrixHash.entity, BitrixHash.record_id, BitrixHash.hash)
+            )).tuples():
+                stored.setdefault(entity, {})[record_id] = record_hash
+
+        if stored['payload'].get(0) == payload_hash:
+            await self.db.rollback()
+            timings['apply'] = time.perf_counter() - started
+            return {'message': 'success', 'changed': False, 'counts': counts, 'timings': timings}
+
+        changed_departments = [
+            dep_id for dep_id, dep_hash in hashes['department'].items()
+            if stored['department'].get(dep_id) != dep_hash
+        ]
+        changed_employees = [
+            emp_id for emp_id, emp_hash in hashes['employee'].items()
+            if stored['employee'].get(emp_id) != emp_hash
+        ]
+
         # --- Синхронизация отделов ---
-        bitrix_deps_by_id = {d['id']: d for d in bitrix_data['departments']}
-        db_deps = self.__get_departments_db()
-        db_deps_by_id = {d['id']: d for d in db_deps}
-
-        # Удаляем лишние отделы
-        for db_id in list(db_deps_by_id.keys()):
-            if db_id not in bitrix_deps_by_id:
-                self.db.query(Department).filter(Department.id == db_id).delete()
-
-        # Добавляем/обновляем отделы
-        for bitrix_dep in bitrix_data['departments']:
-            db_dep = self.db.query(Department).filter(Department.id == bitrix_dep['id']).first()
-            if db_dep:
-                if db_dep.dep_name != bitrix_dep['dep_name']:
-                    db_dep.dep_name = bitrix_dep['dep_name']
-            else:
-                new_dep = Department(id=bitrix_dep['id'], dep_name=bitrix_dep['dep_name'])
-                self.db.add(new_dep)
+        counts['departments'].update(await self.__upsert(Department, 'dep_name', [
+            {'id': dep_id, **departments[dep_id]} for dep_id in changed_departments
+        ]))
 
         # --- Синхронизация сотрудников ---
-        bitrix_emps_by_id = {e['id']: e for e in bitrix_data['employees']}
-        db_emps = self.__get_employees_db()
-        db_emps_by_id = {e['id']: e for e in db_emps}
-
-        # Удаляем лишних сотрудников
-        for db_id in list(db_emps_by_id.keys()):
-            if db_id not in bitrix_emps_by_id:
-                self.db.query(Employee).filter(Employee.id == db_id).delete()
-
-        # Обновляем/добавляем сотрудников + связи
-        for bitrix_emp in bitrix_data['employees']:
-            db_emp = self.db.query(Employee).options(joinedload(Employee.departments)).filter(Employee.id == bitrix_emp['id']).first()
-            full_name = bitrix_emp['full_name'].strip()
-            dep_ids = bitrix_emp['department_id'] or []
-
-            if db_emp:
-                if db_emp.full_name != full_name:
-                    db_emp.full_name = full_name
-                # Обновляем связи
-                existing_dep_ids = {d.id for d in db_emp.departments}
-                target_dep_ids = set(dep_ids)
-
-                # Удаляем лишние связи
-                for d in list(db_emp.departments):
-                    if d.id not in target_dep_ids:
-                        db_emp.departments.remove(d)
-
-                # Добавляем недостающие связи
-                for dep_id in target_dep_ids - existing_dep_ids:
-                    dep = self.db.query(Department).filter(Department.id == dep_id).first()
-                    if dep:
-                        db_emp.departments.append(dep)
-            else:
-                # Создаём нового сотрудника
-                new_emp = Employee(id=bitrix_emp['id'], full_name=full_name)
-                self.db.add(new_emp)
-                self.db.flush()  # чтобы получить id, если autoincrement (но у вас id уже задан)
-                # Добавляем связи
-                for dep_id in dep_ids:
-                    dep = self.db.query(Department).filter(Department.id == dep_id).first()
-                    if dep:
-                        new_emp.departments.append(dep)
+        counts['employees'].update(await self.__upsert(Employee, 'full_name', [
+            {'id': emp_id, 'full_name': employees[emp_id]['full_name']} for emp_id in changed_employees
+        ]))
+
+        # --- Синхронизация связей сотрудник-отдел ---
+        # Связи удаляемых сотрудников и отделов убираем одним запросом
+        current_employee_ids = literal(list(employees), ARRAY(Integer))
+        current_department_ids = literal(list(departments), ARRAY(Integer))
+        counts['links']['deleted'] += (await self.db.execute(
+            delete(employee_department).where(or_(
+                employee_department.c.employee_id != all_(current_employee_ids),
+                employee_department.c.department_id != all_(current_department_ids),
+            ))
+        )).rowcount
+
+        # У остальных сверяем связи только для сотрудников с изменившимся хэшем
+        inserted, deleted = await self.__replace_links({emp_id: employees[emp_id] for emp_id in changed_employees})
+        counts['links']['inserted'] += inserted
+        counts['links']['deleted'] += deleted
+
+        # Удаляем лишних сотрудников (кроме тех, у кого есть история) и отделы
+        counts['employees']['deleted'] = (await self.db.execute(
+            delete(Employee).where(Employee.id != all_(current_employee_ids), _without_history())
+        )).rowcount
+        counts['departments']['deleted'] = (await self.db.execute(
+            delete(Department).where(Department.id != all_(current_department_ids))
+        )).rowcount
+
+        # Запоминаем хэши вместе с изменениями, в той же транзакции
+        await self.__store_hashes(hashes, stored, payload_hash)
 
         # Фиксируем изменения
-        self.db.commit()
-        return {'message': 'success'}
+        await self.db.commit()
+        timings['apply'] = time.perf_counter() - started
 
-    
+        return {'message': 'success', 'changed': True, 'counts': counts, 'timings': timings}
 
-    
-    def __get_departments_db(self):
-        data = self.db.query(Department).all()
-        return [{"id": item.id, "dep_name": item.dep_name} for item in data]
+    async def apply_changes(
+        self,
+        departments: Dict[int, dict],
+        employees: Dict[int, dict],
+        deleted_department_ids: List[int],
+        deleted_employee_ids: List[int],
+    ):
+        """
+        Применяет точечные изменения из вебхуков битрикса: upsert переданных
+        отделов и сотрудников (в формате __fetch_departments/__fetch_employees)
+        и удаление по id (сотрудники с историей не удаляются, только теряют
+        отделы). Хэши затронутых записей обновляются, чтобы ночная
+        полная синхронизация их не трогала
+        """
+        counts = {
+            'departments': {'inserted': 0, 'updated': 0, 'deleted': 0},
+            'employees': {'inserted': 0, 'updated': 0, 'deleted': 0},
+            'links': {'inserted': 0, 'deleted': 0},
+        }
+        departments = {dep_id: {'dep_name': dep['dep_name']} for dep_id, dep in departments.items()}
 
-    def __get_employees_db(self):
-        data = self.db.query(Employee).options(joinedload(Employee.departments)).all()
-        return [
-            {
-                "id": item.id,
-                "full_name": item.full_name,
-                "department_id": [d.id for d in item.departments],  # ← Вот здесь исправлено
+        # Связи создаём только с отделами, которые есть в базе или приходят в этой пачке
+        known_department_ids = set((await self.db.execute(select(Department.id))).scalars())
+        known_department_ids = (known_department_ids | set(departments)) - set(deleted_department_ids)
+        employees = {
+            emp_id: {
+                'full_name': emp['full_name'].strip(),
+                'department_id': sorted({
+                    int(dep_id) for dep_id in emp['department_id'] or [] if int(dep_id) in known_department_ids
+                }),
             }
-            for item in data
+            for emp_id, emp in employees.items()
+        }
+
+        counts['departments'].update(await self.__upsert(Department, 'dep_name', [
+            {'id': dep_id, **dep} for dep_id, dep in departments.items()
+        ]))
+        counts['employees'].update(await self.__upsert(Employee, 'full_name', [
+            {'id': emp_id, 'full_name': emp['full_name']} for emp_id, emp in employees.items()
+        ]))
+        inserted, deleted = await self.__replace_links(employees)
+        counts['links']['inserted'] += inserted
+        counts['links']['deleted'] += deleted
+
+        # Хэши сотрудников удаляемых отделов устарели: полная синхронизация пересчитает их
+        stale_hash_employee_ids = set()
+        if deleted_department_ids or deleted_employee_ids:
+            unlinked_employee_ids = (await self.db.execute(
+                delete(employee_department).where(or_(
+                    employee_department.c.employee_id == any_(literal(deleted_employee_ids, ARRAY(Integer))),
+                    employee_department.c.department_id == any_(literal(deleted_department_ids, ARRAY(Integer))),
+                )).returning(employee_department.c.employee_id)
+            )).scalars().all()
+            counts['links']['deleted'] += len(unlinked_employee_ids)
+            stale_hash_employee_ids = set(unlinked_employee_ids) - set(deleted_employee_ids) - set(employees)
+        if deleted_employee_ids:
+            counts['employees']['deleted'] = (await self.db.execute(
+                delete(Employee).where(
+                    Employee.id == any_(literal(deleted_employee_ids, ARRAY(Integer))), _without_history(),
+                )
+            )).rowcount
+        if deleted_department_ids:
+            counts['departments']['deleted'] = (await self.db.execute(
+                delete(Department).where(Department.id == any_(literal(deleted_department_ids, ARRAY(Integer))))
+            )).rowcount
+
+        await self.__update_hashes(
+            {
+                'department': {dep_id: _record_hash(dep) for dep_id, dep in departments.items()},
+                'employee': {emp_id: _record_hash(emp) for emp_id, emp in employees.items()},
+            },
+            {
+                'department': list(deleted_department_ids),
+                'employee': list(deleted_employee_ids) + list(stale_hash_employee_ids),
+            },
+        )
+
+        await self.db.commit()
+        return {'message': 'success', 'counts': counts}
+
+    async def __replace_links(self, employees: Dict[int, dict]):
+        """
+        Приводит связи переданных сотрудников к их department_id.
+        Возвращает число добавленных и удалённых связей
+        """
+        if not employees:
+            return 0, 0
+
+        target_links = {
+            (emp_id, dep_id)
+            for emp_id, emp in employees.items()
+            for dep_id in emp['department_id']
+        }
+        existing_links = set((await self.db.execute(
+            select(employee_department.c.employee_id, employee_department.c.department_id)
+            .where(employee_department.c.employee_id == any_(literal(list(employees), ARRAY(Integer))))
+        )).tuples())
+
+        deleted = 0
+        stale_links = existing_links - target_links
+        if stale_links:
+            stale_employee_ids, stale_department_ids = zip(*stale_links)
+            deleted = (await self.db.execute(
+                delete(employee_department).where(
+                    tuple_(employee_department.c.employee_id, employee_department.c.department_id).in_(
+                        select(
+                            func.unnest(literal(list(stale_employee_ids), ARRAY(Integer))),
+                            func.unnest(literal(list(stale_department_ids), ARRAY(Integer))),
+                        )
+                    )
+                )
+            )).rowcount
+
+        # Добавляем недостающие связи
+        new_links = [
+            {'employee_id': emp_id, 'department_id': dep_id}
+            for emp_id, dep_id in sorted(target_links - existing_links)
+        ]
+        for chunk in _chunks(new_links, SYNC_CHUNK_SIZE):
+            await self.db.execute(insert(employee_department).values(chunk))
+
+        return len(new_links), deleted
+
+    async def __fetch_bitrix_data(self):
+        """Отделы и сотрудники загружаются параллельно через одно keep-alive соединение"""
+        if self.client is not None:
+            return await self.__fetch_with(self.client)
+        async with httpx.AsyncClient(
+            timeout=BITRIX_TIMEOUT,
+            limits=httpx.Limits(max_connections=BITRIX_MAX_WORKERS),
+        ) as client:
+            return await self.__fetch_with(client)
+
+    async def __fetch_with(self, client: httpx.AsyncClient, employee_ids: Optional[List[int]] = None):
+        departments, employees = await asyncio.gather(
+            self.__fetch_departments(client),
+            self.__fetch_employees(client, employee_ids),
+        )
+        return {'departments': departments, 'employees': employees}
+
+    async def fetch_records(self, department_ids: List[int], employee_ids: List[int]):
+        """
+        Загружает из битрикса только указанные отделы и сотрудников.
+        Отделов немного, их список берём целиком и фильтруем;
+        сотрудников запрашиваем фильтром по ID
+        """
+        if self.client is not None:
+            data = await self.__fetch_records_with(self.client, employee_ids)
+        else:
+            async with httpx.AsyncClient(timeout=BITRIX_TIMEOUT) as client:
+                data = await self.__fetch_records_with(client, employee_ids)
+        department_ids = set(department_ids)
+        data['departments'] = [d for d in data['departments'] if d['id'] in department_ids]
+        return data
+
+    async def __fetch_records_with(self, client: httpx.AsyncClient, employee_ids: List[int]):
+        if employee_ids:
+            return await self.__fetch_with(client, employee_ids)
+        return {'departments': await self.__fetch_departments(client), 'employees': []}
+
+    async def __upsert(self, model, column: str, rows: List[dict]) -> Dict[str, int]:
+        """
+        INSERT ... ON CONFLICT (id) DO UPDATE только для строк, где значение
+        изменилось. Возвращает число вставленных и обновлённых строк
+        """
+        counts = {'inserted': 0, 'updated': 0}
+        for chunk in _chunks(rows, SYNC_CHUNK_SIZE):
+            stmt = pg_insert(model).values(chunk)
+            # xmax = 0 только у строк, которые вставлены, а не обновлены
+            inserted = (await self.db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[model.id],
+                    set_={column: stmt.excluded[column]},
+                    where=getattr(model, column).is_distinct_from(stmt.excluded[column]),
+                ).returning(literal_column('xmax = 0'))
+            )).scalars().all()
+            counts['inserted'] += sum(inserted)
+            counts['updated'] += len(inserted) - sum(inserted)
+        return counts
+
+    async def __store_hashes(self, hashes: Dict[str, Dict[int, str]], stored: Dict[str, Dict[int, str]], payload_hash: str):
+        """Записывает изменившиеся хэши и удаляет хэши пропавших записей"""
+        rows = [
+            {'entity': entity, 'record_id': record_id, 'hash': record_hash}
+            for entity, entity_hashes in hashes.items()
+            for record_id, record_hash in entity_hashes.items()
+            if stored[entity].get(record_id) != record_hash
         ]
+        rows.append({'entity': 'payload', 'record_id': 0, 'hash': payload_hash})
+        await self.__upsert_hashes(rows)
+        for entity, entity_hashes in hashes.items():
+            await self.db.execute(
+                delete(BitrixHash).where(
+                    BitrixHash.entity == entity,
+                    BitrixHash.record_id != all_(literal(list(entity_hashes), ARRAY(Integer))),
+                )
+            )
+
+    async def __update_hashes(self, hashes: Dict[str, Dict[int, str]], deleted: Dict[str, List[int]]):
+        """
+        Точечно обновляет хэши после изменений из вебхуков. Хэш всей выгрузки
+        сбрасывается: следующая полная синхронизация сверит записи по одной
+        """
+        await self.__upsert_hashes([
+            {'entity': entity, 'record_id': record_id, 'hash': record_hash}
+            for entity, entity_hashes in hashes.items()
+            for record_id, record_hash in entity_hashes.items()
+        ])
+        for entity, record_ids in deleted.items():
+            if record_ids:
+                await self.db.execute(
+                    delete(BitrixHash).where(
+                        BitrixHash.entity == entity,
+                        BitrixHash.record_id == any_(literal(record_ids, ARRAY(Integer))),
+                    )
+                )
+        await self.db.execute(delete(BitrixHash).where(BitrixHash.entity == 'payload'))
 
-    def __fetch_departments(self):
-        response = self.__fetch_all_data(
-            url=f'https://tandem-consult.ru/rest/516/{os.getenv("BITRIX_TOKEN")}/department.get',
+    async def __upsert_hashes(self, rows: List[dict]):
+        for chunk in _chunks(rows, SYNC_CHUNK_SIZE):
+            stmt = pg_insert(BitrixHash).values(chunk)
+            await self.db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[BitrixHash.entity, BitrixHash.record_id],
+                    set_={'hash': stmt.excluded.hash},
+                )
+            )
+
+    async def __fetch_departments(self, client: httpx.AsyncClient):
+        response = await self.__fetch_all_data(
+            client,
+            url=f'{BITRIX_URL}/{os.getenv("BITRIX_TOKEN")}/department.get',
             total_key='total',
             data_key='result',
             params={
@@ -392,17 +1049,22 @@ class BitrixService:
         } for item in response]
         return data # Список всех отделов
 
-    def __fetch_employees(self):
-        response = self.__fetch_all_data(
-            url=f'https://tandem-consult.ru/rest/516/82r9f32dxjjsar8b/user.get',
+    async def __fetch_employees(self, client: httpx.AsyncClient, employee_ids: Optional[List[int]] = None):
+        params = {    "ADMIN_MODE": True,
+            "USER_TYPE": "employee",
+            "SORT": "ID",
+            "ORDER": "asc",
+            "ACTIVE": True,
+        }
+        if employee_ids:
+            # При заданном FILTER битрикс не учитывает условия верхнего уровня
+            params["FILTER"] = {"ID": list(employee_ids), "USER_TYPE": "employee", "ACTIVE": True}
+        response = await self.__fetch_all_data(
+            client,
+            url=f'{BITRIX_URL}/82r9f32dxjjsar8b/user.get',
             total_key='total',
             data_key='result',
-            params = {    "ADMIN_MODE": True,
-                "USER_TYPE": "employee",
-                "SORT": "ID",
-                "ORDER": "asc",
-                "ACTIVE": True,
-            },
+            params=params,
         )
         data = [{
             "id": int(item.get('ID')),
@@ -411,40 +1073,181 @@ class BitrixService:
         } for item in response]
         return data # Список всех сотрудников
 
-    def __fetch_all_data(self, url, params: dict, total_key='total', next_key='next', data_key='items', ):
-        all_data = []
-        start = 0
+    async def __fetch_all_data(self, client: httpx.AsyncClient, url, params: dict, total_key='total', next_key='next', data_key='items', ):
+        """
+        Первая страница запрашивается отдельно: из неё берём total и размер
+        страницы, остальные страницы качаем параллельно (не больше
+        BITRIX_MAX_WORKERS запросов одновременно)
+        """
+        data = await self.__post(client, url, {**params, 'start': 0})
+        all_data = list(data[data_key])
 
-        while True:
-            params = params.copy()
-            params['start'] = start
-            resp = requests.post(url, json=params)
-            resp.raise_for_status()
-            data = resp.json()
+        total = data[total_key]
+        page_size = data.get(next_key)
+        if page_size is None or len(all_data) >= total:
+            return all_data
 
-            records = data[data_key]
-            all_data.extend(records)
+        offsets = range(page_size, total, page_size)
+        if BITRIX_BATCH:
+            pages = await self.__fetch_pages_batch(client, url, params, offsets)
+        else:
+            semaphore = asyncio.Semaphore(BITRIX_MAX_WORKERS)
 
-            total = data[total_key]
-            if len(all_data) >= total:
-                break
+            async def fetch_page(start):
+                async with semaphore:
+                    page = await self.__post(client, url, {**params, 'start': start})
+                    return page[data_key]
 
-            start = data.get(next_key)
-            if start is None:
-                break
+            # gather сохраняет порядок страниц
+            pages = await asyncio.gather(*(fetch_page(start) for start in offsets))
+
+        for records in pages:
+            all_data.extend(records)
 
         return all_data
+
+    async def __fetch_pages_batch(self, client: httpx.AsyncClient, url, params: dict, offsets):
+        """
+        Запрашивает страницы через метод batch: до BITRIX_BATCH_SIZE страниц
+        за один HTTP-запрос. Команды, вернувшие ошибку, повторяются отдельно
+        """
+        base_url, method = url.rsplit('/', 1)
+        commands = {
+            f'page_{start}': f'{method}?{_bitrix_query({**params, "start": start})}'
+            for start in offsets
+        }
+        keys = list(commands)
+        semaphore = asyncio.Semaphore(BITRIX_MAX_WORKERS)
+
+        async def run_batch(batch_keys):
+            pending = {key: commands[key] for key in batch_keys}
+            results = {}
+            async with semaphore:
+                for attempt in range(BITRIX_RETRIES + 1):
+                    data = (await self.__post(client, f'{base_url}/batch', {'halt': 0, 'cmd': pending}))['result']
+                    errors = data.get('result_error') or {}
+                    results.update({key: value for key, value in (data.get('result') or {}).items() if key not in errors})
+                    pending = {key: command for key, command in pending.items() if key not in results}
+                    if not pending:
+                        return results
+                    if attempt == BITRIX_RETRIES:
+                        raise ValueError(f"Ошибка batch-запроса к битриксу: {errors}")
+                    await asyncio.sleep(BITRIX_BACKOFF * 2 ** attempt)
+
+        batches = await asyncio.gather(*(
+            run_batch(keys[start:start + BITRIX_BATCH_SIZE])
+            for start in range(0, len(keys), BITRIX_BATCH_SIZE)
+        ))
+        results = {}
+        for batch in batches:
+            results.update(batch)
+        return [results[key] for key in keys]
+
+    async def __post(self, client: httpx.AsyncClient, url, params: dict):
+        """POST в битрикс с повторами и экспоненциальной задержкой"""
+        for attempt in range(BITRIX_RETRIES + 1):
+            try:
+                resp = await client.post(url, json=params)
+                if resp.status_code not in BITRIX_RETRY_STATUSES:
+                    resp.raise_for_status()
+                    return resp.json()
+                if attempt == BITRIX_RETRIES:
+                    resp.raise_for_status()
+            except httpx.TransportError:
+                if attempt == BITRIX_RETRIES:
+                    raise
+            await asyncio.sleep(BITRIX_BACKOFF * 2 ** attempt)
     
 
 class AuthService:
+    """
+    Роли пользователей из сервиса авторизации. Ответы кэшируются на
+    AUTH_CACHE_TTL секунд по (token, app_name), отклонённые токены - на
+    AUTH_NEGATIVE_TTL. Одновременные проверки одного токена уходят
+    в сервис одним запросом
+    """
+    _client: Optional[httpx.AsyncClient] = None
+    _cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+    # Обращения к сервису авторизации: количество, ошибки и время
+    _upstream = {'calls': 0, 'errors': 0, 'rejected': 0, 'seconds_total': 0.0, 'seconds_max': 0.0}
+
+    @classmethod
+    def _get_client(cls) -> httpx.AsyncClient:
+        if cls._client is None:
+            cls._client = httpx.AsyncClient(
+                base_url=AUTH_SERVICE_URL,
+                timeout=AUTH_TIMEOUT,
+                limits=httpx.Limits(max_connections=AUTH_MAX_CONNECTIONS),
+            )
+        return cls._client
+
+    @classmethod
+    async def close(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
     @staticmethod
-    def check_role(token, app):
+    def _cache_key(token: str, app: str) -> str:
+        # Сами токены в памяти не держим
+        return hashlib.sha256(f'{app}\0{token}'.encode()).hexdigest()
+
+    @classmethod
+    async def check_role(cls, token: str, app: str) -> Optional[str]:
+        """
+        Возвращает роль пользователя или None, если сервис авторизации
+        отклонил токен. ValueError - сервис авторизации недоступен
+        """
+        return await cls._cache.get_or_load(
+            cls._cache_key(token, app),
+            lambda: cls._fetch_role(token, app),
+            ttl=lambda role: AUTH_CACHE_TTL if role is not None else AUTH_NEGATIVE_TTL,
+        )
+
+    @classmethod
+    def invalidate(cls, token: str, app: str):
+        """Забывает закэшированный вердикт по токену (например, после смены роли)"""
+        cls._cache.pop(cls._cache_key(token, app))
+
+    @classmethod
+    def clear_cache(cls):
+        cls._cache.clear()
+
+    @classmethod
+    def metrics(cls) -> dict:
+        cache = cls._cache.stats()
+        lookups = cache['hits'] + cache['misses'] + cache['coalesced']
+        upstream = dict(cls._upstream)
+        return {
+            'cache': {
+                **cache,
+                # Склеенные запросы тоже не ходят в сервис авторизации
+                'hit_ratio': (cache['hits'] + cache['coalesced']) / lookups if lookups else 0.0,
+            },
+            'upstream': {
+                **upstream,
+                'seconds_avg': upstream['seconds_total'] / upstream['calls'] if upstream['calls'] else 0.0,
+            },
+        }
+
+    @classmethod
+    async def _fetch_role(cls, token: str, app: str) -> Optional[str]:
+        started = time.perf_counter()
+        cls._upstream['calls'] += 1
         try:
-            response = requests.get(
-                'http://10.100.50.37:8125/check_role', # HARDCODE - адрес сервиса авторизации
+            response = await cls._get_client().get(
+                '/check_role',
                 params={'auth_token': token, 'app_name': app}
             )
+            if response.status_code in AUTH_REJECT_STATUSES:
+                cls._upstream['rejected'] += 1
+                return None
             response.raise_for_status()
             return response.json().get('role')
-        except requests.exceptions.RequestException:
-            raise ValueError("Failed to check role")
\ No newline at end of file
+        except httpx.HTTPError:
+            cls._upstream['errors'] += 1
+            raise ValueError("Failed to check role")
+        finally:
+            elapsed = time.perf_counter() - started
+            cls._upstream['seconds_total'] += elapsed
+            cls._upstream['seconds_max'] = max(cls._upstream['seconds_max'], elapsed)
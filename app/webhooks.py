@@ -0,0 +1,292 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import sys
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import httpx
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+from app.database import SessionLocal
+from app.services import BitrixService
+
+logger = logging.getLogger(__name__)
+
+# application_token из настроек обработчика событий в битриксе. Пусто - приём вебхуков выключен
+BITRIX_APP_TOKEN = os.getenv('BITRIX_APP_TOKEN', '')
+# Сколько секунд копить события перед применением одной пачкой
+BITRIX_WEBHOOK_WINDOW = float(os.getenv('BITRIX_WEBHOOK_WINDOW', '2'))
+# Пачка, которую не удалось применить, повторяется с удвоением паузы до этого предела, секунд
+BITRIX_WEBHOOK_RETRY_MAX = float(os.getenv('BITRIX_WEBHOOK_RETRY_MAX', '300'))
+# Сколько раз подряд запись может не примениться, прежде чем её отложат в сторону
+BITRIX_WEBHOOK_MAX_ATTEMPTS = int(os.getenv('BITRIX_WEBHOOK_MAX_ATTEMPTS', '5'))
+# Файл, куда дописываются входящие вебхуки (JSON Lines) для последующего воспроизведения
+BITRIX_WEBHOOK_RECORD = os.getenv('BITRIX_WEBHOOK_RECORD', '')
+
+# Префиксы событий битрикса: ONUSERADD, ONUSERUPDATE, ONDEPARTMENTCREATE, ONDEPARTMENTDELETE...
+EVENT_ENTITIES = {
+    'ONUSER': 'employee',
+    'ONDEPARTMENT': 'department',
+}
+
+
+def parse_bitrix_form(body: str) -> dict:
+    """
+    Разбирает form-urlencoded тело вебхука битрикса во вложенный словарь:
+    data[FIELDS][ID]=5 -> {'data': {'FIELDS': {'ID': '5'}}}
+    """
+    result = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        parts = key.replace(']', '').split('[')
+        node = result
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return result
+
+
+def parse_payload(body: str, content_type: str = '') -> dict:
+    """Тело вебхука как словарь; ValueError, если это не объект"""
+    payload = json.loads(body) if 'json' in content_type else parse_bitrix_form(body)
+    if not isinstance(payload, dict):
+        raise ValueError("Тело вебхука должно быть объектом")
+    return payload
+
+
+def parse_event(payload: dict) -> Optional[Tuple[str, str, int]]:
+    """
+    Возвращает (entity, action, id) или None, если событие нас не интересует.
+    ValueError - интересующее событие с некорректными data или ID
+    """
+    event = str(payload.get('event', '')).upper()
+    for prefix, entity in EVENT_ENTITIES.items():
+        if event.startswith(prefix):
+            break
+    else:
+        return None
+
+    data = payload.get('data') or {}
+    fields = data.get('FIELDS') or data if isinstance(data, dict) else None
+    if not isinstance(fields, dict):
+        raise ValueError("Некорректное поле data события")
+    record_id = fields.get('ID')
+    if record_id is None:
+        return None
+    try:
+        record_id = int(record_id)
+    except (TypeError, ValueError):
+        raise ValueError(f"Некорректный ID записи: {record_id!r}")
+    action = 'delete' if event.endswith('DELETE') else 'upsert'
+    return entity, action, record_id
+
+
+def check_token(payload: dict) -> bool:
+    if not BITRIX_APP_TOKEN:
+        return False
+    auth = payload.get('auth')
+    token = auth.get('application_token', '') if isinstance(auth, dict) else ''
+    return hmac.compare_digest(str(token), BITRIX_APP_TOKEN)
+
+
+def record(body: str, content_type: str):
+    """Дописывает вебхук в BITRIX_WEBHOOK_RECORD. Пишет в файл синхронно: из async-кода звать в пуле потоков"""
+    if BITRIX_WEBHOOK_RECORD:
+        with open(BITRIX_WEBHOOK_RECORD, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'content_type': content_type, 'body': body}, ensure_ascii=False) + '\n')
+
+
+class WebhookBuffer:
+    """
+    Копит события из вебхуков битрикса и раз в BITRIX_WEBHOOK_WINDOW секунд
+    применяет их одной пачкой. Повторные события по одной записи схлопываются,
+    побеждает последнее. Самому событию не доверяем: любая запись, упомянутая
+    в нём, перечитывается из битрикса и удаляется, только если битрикс её
+    больше не возвращает.
+
+    Если пачку не удалось записать в базу, она делится пополам, пока не
+    найдутся записи, которые не применяются сами по себе: остальные
+    применяются, а такие записи повторяются в следующих пачках и после
+    BITRIX_WEBHOOK_MAX_ATTEMPTS неудач откладываются в failed
+    """
+
+    def __init__(self, window: float = BITRIX_WEBHOOK_WINDOW, client: Optional[httpx.AsyncClient] = None):
+        self.window = window
+        self.client = client
+        self._pending: Dict[Tuple[str, int], str] = {}
+        # Неудачные попытки по записи и отложенные записи: действие и последняя ошибка
+        self._attempts: Dict[Tuple[str, int], int] = {}
+        self.failed: Dict[Tuple[str, int], Tuple[str, str]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Не теряем накопленные события при остановке
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to apply Bitrix webhook events on shutdown")
+
+    def add(self, entity: str, action: str, record_id: int):
+        self._pending[(entity, record_id)] = action
+        self.failed.pop((entity, record_id), None)
+        self._wakeup.set()
+
+    async def _run(self):
+        delay = self.window
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(delay)
+            try:
+                result = await self.flush()
+            except Exception:
+                delay = min(delay * 2, BITRIX_WEBHOOK_RETRY_MAX)
+                logger.exception("Failed to apply Bitrix webhook events, retrying in %.0f s", delay)
+                continue
+            if result is not None and result['retry']:
+                delay = min(delay * 2, BITRIX_WEBHOOK_RETRY_MAX)
+            else:
+                delay = self.window
+
+    async def flush(self):
+        """
+        Применяет накопленные события. Возвращает None, если применять нечего,
+        иначе счётчики apply_changes и списки записей: retry - вернулись в
+        очередь, failed - отложены после BITRIX_WEBHOOK_MAX_ATTEMPTS неудач.
+        Если битрикс недоступен, вся пачка возвращается в очередь (более новые
+        события по тем же записям не затираются) и исключение пробрасывается
+        """
+        self._wakeup.clear()
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return None
+        try:
+            data = await self._fetch(pending)
+        except BaseException:
+            self._requeue(pending)
+            raise
+
+        result = {'message': 'success', 'counts': {}, 'retry': [], 'failed': []}
+        unapplied = set(pending)
+        try:
+            await self._apply_split(pending, data, unapplied, result)
+        except BaseException:
+            # База недоступна или отмена посреди применения: неприменённое возвращается в очередь
+            self._requeue({key: pending[key] for key in unapplied})
+            raise
+        return result
+
+    def _requeue(self, pending: Dict[Tuple[str, int], str]):
+        for key, action in pending.items():
+            self._pending.setdefault(key, action)
+        self._wakeup.set()
+
+    async def _fetch(self, pending: Dict[Tuple[str, int], str]) -> dict:
+        ids = {'department': [], 'employee': []}
+        for entity, record_id in pending:
+            ids[entity].append(record_id)
+        async with SessionLocal() as db:
+            data = await BitrixService(db, client=self.client).fetch_records(ids['department'], ids['employee'])
+        return {
+            'department': {d['id']: d for d in data['departments']},
+            'employee': {e['id']: e for e in data['employees']},
+        }
+
+    async def _apply_split(self, pending: Dict[Tuple[str, int], str], data: dict, unapplied: set, result: dict):
+        parts = [list(pending)]
+        while parts:
+            keys = parts.pop()
+            try:
+                counts = await self._apply(keys, data)
+            except Exception as e:
+                if _is_transient(e):
+                    raise
+                if len(keys) > 1:
+                    middle = len(keys) // 2
+                    parts += [keys[middle:], keys[:middle]]
+                else:
+                    self._record_failure(keys[0], pending[keys[0]], e, result)
+                    unapplied.discard(keys[0])
+                continue
+            _add_counts(result['counts'], counts)
+            for key in keys:
+                self._attempts.pop(key, None)
+                unapplied.discard(key)
+
+    def _record_failure(self, key: Tuple[str, int], action: str, error: Exception, result: dict):
+        attempts = self._attempts.get(key, 0) + 1
+        if attempts < BITRIX_WEBHOOK_MAX_ATTEMPTS:
+            self._attempts[key] = attempts
+            self._requeue({key: action})
+            result['retry'].append(key)
+            logger.warning("Bitrix webhook %s %s failed (attempt %d): %s", action, key, attempts, error)
+        else:
+            self._attempts.pop(key, None)
+            self.failed[key] = (action, str(error))
+            result['failed'].append(key)
+            logger.error("Bitrix webhook %s %s failed %d times, parked: %s", action, key, attempts, error)
+
+    async def _apply(self, keys, data: dict):
+        """
+        Применяет записи keys одной транзакцией. Удаляем только то, чего битрикс
+        не вернул (удалены, уволены) - и для событий *DELETE, и для *ADD/*UPDATE
+        """
+        ids = {'department': [], 'employee': []}
+        for entity, record_id in keys:
+            ids[entity].append(record_id)
+        async with SessionLocal() as db:
+            return (await BitrixService(db).apply_changes(
+                {i: data['department'][i] for i in ids['department'] if i in data['department']},
+                {i: data['employee'][i] for i in ids['employee'] if i in data['employee']},
+                [i for i in ids['department'] if i not in data['department']],
+                [i for i in ids['employee'] if i not in data['employee']],
+            ))['counts']
+
+
+def _is_transient(error: Exception) -> bool:
+    """Ошибка связи с базой, а не конкретной записи: такую пачку не делим"""
+    if isinstance(error, DBAPIError):
+        return error.connection_invalidated or isinstance(error, (OperationalError, InterfaceError))
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+
+def _add_counts(total: dict, counts: dict):
+    for group, values in counts.items():
+        for name, value in values.items():
+            total.setdefault(group, {}).setdefault(name, 0)
+            total[group][name] += value
+
+
+webhook_buffer = WebhookBuffer()
+
+
+async def replay(path: str, buffer: Optional[WebhookBuffer] = None):
+    """Воспроизводит записанные вебхуки (BITRIX_WEBHOOK_RECORD) одной пачкой"""
+    buffer = buffer or WebhookBuffer()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            recorded = json.loads(line)
+            event = parse_event(parse_payload(recorded['body'], recorded.get('content_type', '')))
+            if event is not None:
+                buffer.add(*event)
+    return await buffer.flush()
+
+
+if __name__ == '__main__':
+    # python -m app.webhooks recorded.jsonl
+    print(asyncio.run(replay(sys.argv[1])))
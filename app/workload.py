@@ -0,0 +1,464 @@
+import json
+import os
+from calendar import monthrange
+from collections import OrderedDict
+from datetime import date, timedelta
+from itertools import chain
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import select, func, literal, and_, any_, cast, Date, Integer, ARRAY
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import DailyWorkload, Employee
+from app.models import WorkloadResponse, WorkloadRunsResponse, WorkloadSeriesResponse
+
+# Формы ответа /workload: плотная (по умолчанию), ряд от первого ненулевого дня или серии одинаковых значений
+WORKLOAD_FORMATS = {
+    'dense': WorkloadResponse,
+    'series': WorkloadSeriesResponse,
+    'rle': WorkloadRunsResponse,
+}
+
+
+class WorkloadMatrix:
+    """
+    Плотная матрица загрузки сотрудники x дни за период.
+
+    values[i, j]  - процент загрузки сотрудника i в день start_date + j
+    present[i, j] - есть ли запись в daily_workloads для этой ячейки
+    (нужно для среднего по дню: считаем только реально заполненные ячейки)
+    """
+
+    def __init__(
+        self,
+        start_date: date,
+        end_date: date,
+        employees: List[Tuple[int, str]],
+        values: np.ndarray,
+        present: np.ndarray,
+    ):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.employees = employees
+        self.values = values
+        self.present = present
+
+    @property
+    def days(self) -> int:
+        return (self.end_date - self.start_date).days + 1
+
+    @property
+    def dates(self) -> List[date]:
+        return [self.start_date + timedelta(days=offset) for offset in range(self.days)]
+
+    @classmethod
+    async def load(cls, db: AsyncSession, start_date: date, end_date: date) -> "WorkloadMatrix":
+        """
+        Загружает загрузку за период одним запросом: по строке на сотрудника
+        с массивами смещений дней и процентов
+        """
+        rows = (await db.execute(
+            select(
+                DailyWorkload.employee_id,
+                Employee.full_name,
+                func.array_agg(DailyWorkload.date - start_date),
+                func.array_agg(DailyWorkload.percent),
+            )
+            .join(DailyWorkload.employee)
+            .where(
+                DailyWorkload.date >= start_date,
+                DailyWorkload.date <= end_date
+            )
+            .group_by(DailyWorkload.employee_id, Employee.full_name)
+            .order_by(DailyWorkload.employee_id)
+        )).all()
+        return cls.from_rows(start_date, end_date, rows)
+
+    @classmethod
+    def from_rows(cls, start_date: date, end_date: date, rows) -> "WorkloadMatrix":
+        """
+        Собирает матрицу из строк (employee_id, full_name, [day_offset], [percent])
+        """
+        days = (end_date - start_date).days + 1
+        employees = [(employee_id, full_name) for employee_id, full_name, _, _ in rows]
+        values = np.zeros((len(employees), days))
+        present = np.zeros((len(employees), days), dtype=bool)
+        if not rows:
+            return cls(start_date, end_date, employees, values, present)
+
+        lengths = [len(day_offsets) for _, _, day_offsets, _ in rows]
+        row_index = np.repeat(np.arange(len(rows)), lengths)
+        day_index = np.fromiter(chain.from_iterable(row[2] for row in rows), dtype=np.int64, count=len(row_index))
+        percents = np.fromiter(chain.from_iterable(row[3] for row in rows), dtype=np.float64, count=len(row_index))
+
+        values[row_index, day_index] = percents
+        present[row_index, day_index] = True
+
+        return cls(start_date, end_date, employees, values, present)
+
+    def daily_average(self) -> np.ndarray:
+        """
+        Средняя загрузка по дням среди сотрудников, у которых есть запись за этот день
+        """
+        totals = self.values.sum(axis=0)
+        counts = self.present.sum(axis=0)
+        return np.divide(totals, counts, out=np.zeros(self.days), where=counts > 0)
+
+    def to_payload(self, format: str = 'dense') -> dict:
+        """Ответ /workload из простых словарей и списков"""
+        return workload_payload(
+            self.start_date, self.end_date, self.employees, self.values, self.daily_average(), format,
+        )
+
+
+def workload_payload(start_date: date, end_date: date, employees, series, totals, format: str = 'dense') -> dict:
+    """
+    Словарь в форме ответа WORKLOAD_FORMATS[format]: employees - (id, full_name),
+    series - ряды процентов по дням в том же порядке (списки или матрица numpy),
+    totals - средняя загрузка по дням
+    """
+    if format != 'dense':
+        return _compact_payload(start_date, end_date, employees, series, totals, format)
+
+    dates = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    if isinstance(series, np.ndarray):
+        series = series.tolist()
+    if isinstance(totals, np.ndarray):
+        totals = totals.tolist()
+    return {
+        'employees': [
+            {
+                'employee': {'id': emp_id, 'full_name': full_name},
+                'workload': [
+                    {'date': day, 'percent': percent}
+                    for day, percent in zip(dates, row)
+                ],
+            }
+            for (emp_id, full_name), row in zip(employees, series)
+        ],
+        'total': [
+            {'date': day, 'percent': percent}
+            for day, percent in zip(dates, totals)
+        ],
+    }
+
+
+def _compact_payload(start_date: date, end_date: date, employees, series, totals, format: str) -> dict:
+    days = (end_date - start_date).days + 1
+    values = np.asarray(series, dtype=np.float64).reshape(len(employees), days)
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'employees': [
+            {'employee': {'id': emp_id, 'full_name': full_name}, **_compact_row(start_date, row, format)}
+            for (emp_id, full_name), row in zip(employees, values)
+        ],
+        'total': _compact_row(start_date, np.asarray(totals, dtype=np.float64), format),
+    }
+
+
+def _compact_row(start_date: date, row: np.ndarray, format: str) -> dict:
+    """
+    Ряд без нулевых дней по краям: start - первый ненулевой день, дальше
+    проценты подряд (series) или пары (процент, число дней) (rle)
+    """
+    key = 'percents' if format == 'series' else 'runs'
+    nonzero = np.flatnonzero(row)
+    if not len(nonzero):
+        return {'start': start_date, key: []}
+    first, last = int(nonzero[0]), int(nonzero[-1])
+    values = row[first:last + 1]
+    start = start_date + timedelta(days=first)
+    if format == 'series':
+        return {'start': start, key: values.tolist()}
+
+    run_starts = np.concatenate(([0], np.flatnonzero(np.diff(values)) + 1))
+    run_lengths = np.diff(np.append(run_starts, len(values)))
+    return {'start': start, key: list(zip(values[run_starts].tolist(), run_lengths.tolist()))}
+
+
+async def aggregate_in_sql(db: AsyncSession, start_date: date, end_date: date, format: str = 'dense') -> dict:
+    """
+    Считает загрузку целиком на стороне Postgres: среднее по дням и
+    дополненные нулями ряды по сотрудникам через generate_series.
+    Из базы приходит по строке на день и по строке на сотрудника.
+    Возвращает словарь в форме ответа WORKLOAD_FORMATS[format] (см. workload_payload)
+    """
+    days_count = (end_date - start_date).days + 1
+    days = func.generate_series(0, days_count - 1).table_valued('day').render_derived(name='days')
+    day_date = literal(start_date, Date) + days.c.day
+
+    totals = (await db.execute(
+        select(func.coalesce(func.avg(DailyWorkload.percent), 0.0))
+        .select_from(days)
+        .outerjoin(DailyWorkload, DailyWorkload.date == day_date)
+        .group_by(days.c.day)
+        .order_by(days.c.day)
+    )).scalars().all()
+
+    # Сотрудники, у которых есть хотя бы одна запись за период
+    active = (
+        select(DailyWorkload.employee_id)
+        .where(
+            DailyWorkload.date >= start_date,
+            DailyWorkload.date <= end_date
+        )
+        .distinct()
+        .subquery()
+    )
+    employees = (await db.execute(
+        select(
+            Employee.id,
+            Employee.full_name,
+            func.array_agg(aggregate_order_by(func.coalesce(DailyWorkload.percent, 0.0), days.c.day)),
+        )
+        .select_from(active)
+        .join(Employee, Employee.id == active.c.employee_id)
+        .join(days, literal(True))
+        .outerjoin(
+            DailyWorkload,
+            and_(
+                DailyWorkload.employee_id == Employee.id,
+                DailyWorkload.date == day_date
+            )
+        )
+        .group_by(Employee.id, Employee.full_name)
+        .order_by(Employee.id)
+    )).all()
+
+    return workload_payload(
+        start_date,
+        end_date,
+        [(emp_id, full_name) for emp_id, full_name, _ in employees],
+        [series for _, _, series in employees],
+        totals,
+        format,
+    )
+
+
+# Кэшировать ли загрузку помесячными блоками в памяти воркера
+WORKLOAD_BLOCK_CACHE = os.getenv('WORKLOAD_BLOCK_CACHE', 'false').lower() in ('1', 'true', 'yes')
+WORKLOAD_BLOCK_CACHE_MONTHS = int(os.getenv('WORKLOAD_BLOCK_CACHE_MONTHS', '36'))  # сколько месяцев держать (LRU)
+# Канал NOTIFY, в который триггеры daily_workloads пишут изменённые пары (сотрудник, месяц)
+WORKLOAD_BLOCKS_CHANNEL = 'workload_blocks'
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _next_month(month: date) -> date:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def _months(start_date: date, end_date: date) -> List[date]:
+    months = []
+    month = _month_start(start_date)
+    while month <= end_date:
+        months.append(month)
+        month = _next_month(month)
+    return months
+
+
+class MonthBlock:
+    """
+    Загрузка всех сотрудников за один календарный месяц:
+    rows[employee_id] = (full_name, values[day], present[day]).
+    missing - сотрудники, чьи строки сброшены и должны быть перечитаны
+    """
+
+    def __init__(self, month: date):
+        self.month = month
+        self.days = monthrange(month.year, month.month)[1]
+        self.rows: Dict[int, Tuple[str, np.ndarray, np.ndarray]] = {}
+        self.missing: Set[int] = set()
+
+    def put(self, employee_id: int, full_name: str, day_offsets, percents):
+        values = np.zeros(self.days)
+        present = np.zeros(self.days, dtype=bool)
+        day_offsets = np.asarray(day_offsets, dtype=np.int64)
+        values[day_offsets] = np.asarray(percents, dtype=np.float64)
+        present[day_offsets] = True
+        self.rows[employee_id] = (full_name, values, present)
+
+
+class WorkloadBlockCache:
+    """
+    Кэш загрузки помесячными блоками: любой диапазон собирается из блоков,
+    из daily_workloads читаются только отсутствующие месяцы (и сброшенные
+    строки сотрудников). Запись в daily_workloads сбрасывает только строку
+    сотрудника в затронутом месяце
+    """
+
+    def __init__(self, max_months: int = WORKLOAD_BLOCK_CACHE_MONTHS):
+        self.max_months = max_months
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks: "OrderedDict[date, MonthBlock]" = OrderedDict()
+
+    async def matrix(self, db: AsyncSession, start_date: date, end_date: date) -> WorkloadMatrix:
+        months = _months(start_date, end_date)
+        epoch = self.epoch
+        blocks = {}
+        to_load = []
+        for month in months:
+            block = self._blocks.get(month)
+            if block is None:
+                to_load.append(month)
+                self.misses += 1
+            else:
+                self._blocks.move_to_end(month)
+                blocks[month] = block
+                self.hits += 1
+
+        if to_load:
+            loaded = await self._load_months(db, to_load)
+            blocks.update(loaded)
+            # Если за время запроса пришла инвалидация, блоки могли устареть - не сохраняем
+            if epoch == self.epoch:
+                for month, block in loaded.items():
+                    self._store(block)
+
+        for month, block in blocks.items():
+            if block.missing:
+                await self._reload_rows(db, block, epoch)
+
+        return self._assemble(start_date, end_date, [blocks[month] for month in months])
+
+    async def _load_months(self, db: AsyncSession, months: List[date]) -> Dict[date, MonthBlock]:
+        """Один запрос на все недостающие месяцы: строка на (сотрудник, месяц)"""
+        month_of = cast(func.date_trunc('month', DailyWorkload.date), Date)
+        rows = (await db.execute(
+            select(
+                DailyWorkload.employee_id,
+                Employee.full_name,
+                month_of,
+                func.array_agg(DailyWorkload.date - month_of),
+                func.array_agg(DailyWorkload.percent),
+            )
+            .join(DailyWorkload.employee)
+            .where(
+                DailyWorkload.date >= months[0],
+                DailyWorkload.date < _next_month(months[-1]),
+                month_of == any_(literal(months, ARRAY(Date))),
+            )
+            .group_by(DailyWorkload.employee_id, Employee.full_name, month_of)
+        )).all()
+
+        blocks = {month: MonthBlock(month) for month in months}
+        for employee_id, full_name, month, day_offsets, percents in rows:
+            blocks[month].put(employee_id, full_name, day_offsets, percents)
+        return blocks
+
+    async def _reload_rows(self, db: AsyncSession, block: MonthBlock, epoch: int):
+        """Перечитывает строки сброшенных сотрудников в блоке"""
+        employee_ids = sorted(block.missing)
+        rows = (await db.execute(
+            select(
+                DailyWorkload.employee_id,
+                Employee.full_name,
+                func.array_agg(DailyWorkload.date - block.month),
+                func.array_agg(DailyWorkload.percent),
+            )
+            .join(DailyWorkload.employee)
+            .where(
+                DailyWorkload.employee_id == any_(literal(employee_ids, ARRAY(Integer))),
+                DailyWorkload.date >= block.month,
+                DailyWorkload.date < _next_month(block.month),
+            )
+            .group_by(DailyWorkload.employee_id, Employee.full_name)
+        )).all()
+        for employee_id, full_name, day_offsets, percents in rows:
+            block.put(employee_id, full_name, day_offsets, percents)
+        if epoch == self.epoch:
+            block.missing.difference_update(employee_ids)
+
+    def _store(self, block: MonthBlock):
+        self._blocks[block.month] = block
+        self._blocks.move_to_end(block.month)
+        while len(self._blocks) > self.max_months:
+            self._blocks.popitem(last=False)
+
+    @staticmethod
+    def _assemble(start_date: date, end_date: date, blocks: List[MonthBlock]) -> WorkloadMatrix:
+        """Склеивает срезы блоков в матрицу за [start_date, end_date]"""
+        days = (end_date - start_date).days + 1
+        # (смещение в блоке, смещение в результате, длина) для каждого блока
+        slices = []
+        for block in blocks:
+            first = max(start_date, block.month)
+            last = min(end_date, block.month + timedelta(days=block.days - 1))
+            slices.append(((first - block.month).days, (first - start_date).days, (last - first).days + 1))
+
+        # В ответ попадают сотрудники, у которых есть хоть одна запись в диапазоне
+        names = {}
+        for block, (offset, _, length) in zip(blocks, slices):
+            for employee_id, (full_name, _, present) in block.rows.items():
+                if employee_id not in names and present[offset:offset + length].any():
+                    names[employee_id] = full_name
+        employees = sorted(names.items())
+        row_of = {employee_id: row for row, (employee_id, _) in enumerate(employees)}
+
+        values = np.zeros((len(employees), days))
+        present = np.zeros((len(employees), days), dtype=bool)
+        for block, (offset, target, length) in zip(blocks, slices):
+            for employee_id, (_, block_values, block_present) in block.rows.items():
+                row = row_of.get(employee_id)
+                if row is not None:
+                    values[row, target:target + length] = block_values[offset:offset + length]
+                    present[row, target:target + length] = block_present[offset:offset + length]
+
+        return WorkloadMatrix(start_date, end_date, employees, values, present)
+
+    # -- Инвалидация --
+
+    def invalidate(self, employee_id: Optional[int] = None, month: Optional[date] = None):
+        """Сбрасывает строку сотрудника в месяце, весь месяц или, без аргументов, всё"""
+        self.epoch += 1
+        if month is None:
+            self._blocks.clear()
+            return
+        block = self._blocks.get(_month_start(month))
+        if block is None:
+            return
+        if employee_id is None:
+            del self._blocks[block.month]
+        else:
+            block.rows.pop(employee_id, None)
+            block.missing.add(employee_id)
+
+    async def clear(self):
+        self.invalidate()
+
+    def handle_notification(self, payload: str):
+        """Уведомление триггера notify_workload_blocks"""
+        message = json.loads(payload)
+        if 'pairs' in message:
+            for employee_id, month in message['pairs']:
+                self.invalidate(employee_id, date.fromisoformat(month))
+        elif 'months' in message:
+            for month in message['months']:
+                self.invalidate(month=date.fromisoformat(month))
+        else:
+            self.invalidate()
+
+    def handle_employee_notification(self, payload: str):
+        """Переименование или удаление сотрудника: имена лежат в блоках, сбрасываем всё"""
+        if json.loads(payload).get('table') == 'employees':
+            self.invalidate()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'months': len(self._blocks),
+            'max_months': self.max_months,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+workload_blocks = WorkloadBlockCache()
@@ -1,16 +1,59 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from app.api import router
-from app.database import create_tables
+from app.scheduler import changes_retention, sync_scheduler
+from app.webhooks import webhook_buffer
+from app.services import AuthService
+from app.auth import warn_if_disabled
+from app.notify import pg_listener
+from app.calendar_index import CALENDAR_INDEX, CALENDAR_INDEX_CHANNEL, calendar_index
+from app.response_cache import RESPONSE_CACHE_CHANNEL, response_cache
+from app.workload import WORKLOAD_BLOCK_CACHE, WORKLOAD_BLOCKS_CHANNEL, workload_blocks
+from app.live import CALENDAR_LIVE, calendar_live
 from fastapi.middleware.cors import CORSMiddleware
 
 
-# Create database tables on startup
-create_tables()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схему создают миграции (alembic upgrade head) до запуска приложения
+    warn_if_disabled()
+    sync_scheduler.start()
+    changes_retention.start()
+    webhook_buffer.start()
+    if CALENDAR_INDEX:
+        # Индекс загружается при каждом подключении LISTEN, дальше живёт на уведомлениях
+        pg_listener.subscribe(CALENDAR_INDEX_CHANNEL, calendar_index.handle_notification)
+        pg_listener.on_connect(calendar_index.load)
+        pg_listener.on_disconnect(calendar_index.unload)
+    if response_cache.enabled:
+        # Пока LISTEN не был подключён, уведомления могли потеряться - сбрасываем кэш
+        pg_listener.subscribe(RESPONSE_CACHE_CHANNEL, response_cache.handle_notification)
+        pg_listener.on_connect(response_cache.clear)
+    if WORKLOAD_BLOCK_CACHE:
+        # Блоки сбрасываются по парам (сотрудник, месяц), при переименованиях - целиком
+        pg_listener.subscribe(WORKLOAD_BLOCKS_CHANNEL, workload_blocks.handle_notification)
+        pg_listener.subscribe(RESPONSE_CACHE_CHANNEL, workload_blocks.handle_employee_notification)
+        pg_listener.on_connect(workload_blocks.clear)
+    if CALENDAR_LIVE:
+        # Триггеры events будят рассылку, сами изменения читаются из журнала
+        pg_listener.subscribe(RESPONSE_CACHE_CHANNEL, calendar_live.handle_notification)
+        pg_listener.on_connect(calendar_live.on_connect)
+    pg_listener.start()
+    yield
+    await calendar_live.stop()
+    await pg_listener.stop()
+    await webhook_buffer.stop()
+    await sync_scheduler.stop()
+    await changes_retention.stop()
+    await AuthService.close()
+
 
 app = FastAPI(
     title="Calendar API",
     version="1.0.3",
     description="Простое API для получения календаря отпусков/командировок и ежедневной загрузки сотрудников.",
+    lifespan=lifespan,
 )
 
 # Include API routes
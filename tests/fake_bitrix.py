@@ -0,0 +1,92 @@
+"""
+Поддельный REST битрикса для тестов: отдаёт отделы и сотрудников из demo.json
+через httpx.MockTransport. Поддерживает постраничные department.get и user.get
+(фильтр по ID) и batch с ошибками в result_error по заказу
+"""
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+
+import httpx
+
+DEMO_PATH = Path(__file__).resolve().parent.parent / 'demo.json'
+
+
+class FakeBitrix:
+    def __init__(self, page_size: int = 50, path: Path = DEMO_PATH):
+        demo = json.loads(path.read_text(encoding='utf-8'))
+        self.page_size = page_size
+        self.departments = [{'ID': d['id'], 'NAME': d['name']} for d in demo['departments']]
+        self.employees = [{
+            'ID': e['id'],
+            'NAME': e['name'],
+            'LAST_NAME': e['last_name'],
+            'SECOND_NAME': e['second_name'],
+            'UF_DEPARTMENT': e['department'],
+        } for e in demo['employees']]
+        # Сколько раз подряд команда batch с этим ключом вернёт ошибку
+        self.failures: Dict[str, int] = {}
+        # Вызовы в порядке поступления: (метод, ключи команд batch или None)
+        self.calls: List[tuple] = []
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+
+    def batch_calls(self) -> List[List[str]]:
+        return [keys for method, keys in self.calls if method == 'batch']
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        method = request.url.path.rsplit('/', 1)[1]
+        params = json.loads(request.content or b'{}')
+        if method == 'batch':
+            self.calls.append((method, list(params['cmd'])))
+            return httpx.Response(200, json={'result': self.batch(params['cmd'])})
+        self.calls.append((method, None))
+        return httpx.Response(200, json=self.page(method, params))
+
+    def batch(self, commands: Dict[str, str]) -> dict:
+        result, errors = {}, {}
+        for key, command in commands.items():
+            if self.failures.get(key):
+                self.failures[key] -= 1
+                errors[key] = {'error': 'QUERY_LIMIT_EXCEEDED', 'error_description': 'Too many requests'}
+                continue
+            method, _, query = command.partition('?')
+            result[key] = self.page(method, _parse_query(query))['result']
+        # Пустые словари PHP отдаёт как []
+        return {'result': result or [], 'result_error': errors or []}
+
+    def page(self, method: str, params: dict) -> dict:
+        records = self.records(method, params)
+        start = int(params.get('start', 0))
+        page = {'result': records[start:start + self.page_size], 'total': len(records)}
+        if start + self.page_size < len(records):
+            page['next'] = start + self.page_size
+        return page
+
+    def records(self, method: str, params: dict) -> list:
+        if method == 'department.get':
+            return sorted(self.departments, key=lambda d: d['NAME'] or '', reverse=True)
+        if method == 'user.get':
+            ids = _filter_ids(params)
+            return [e for e in self.employees if ids is None or e['ID'] in ids]
+        raise AssertionError(f'Неизвестный метод битрикса: {method}')
+
+
+def _parse_query(query: str) -> dict:
+    """Обратное к _bitrix_query для того, что нужно подделке: start и FILTER[ID][n]"""
+    params = {'FILTER': {'ID': []}}
+    for name, value in parse_qsl(query):
+        if name.startswith('FILTER[ID]['):
+            params['FILTER']['ID'].append(value)
+        else:
+            params[name] = value
+    if not params['FILTER']['ID']:
+        del params['FILTER']
+    return params
+
+
+def _filter_ids(params: dict) -> Optional[set]:
+    ids = (params.get('FILTER') or {}).get('ID')
+    return None if ids is None else {str(record_id) for record_id in ids}
@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app import auth
+from app.database import get_db
+from app.models import CreateCalendarEventsBatchResponse
+from app.services import AuthService, CalendarService
+
+pytestmark = pytest.mark.anyio
+
+# Заглушка сервиса авторизации: токен совпадает с ролью, неизвестный токен отклонён
+TOKENS = {role: role for role in ('viewer', 'editor', 'approver', 'admin')}
+
+EVENT = {'employee_id': 1, 'type': 'vacation', 'start': '2025-01-01', 'end': '2025-01-05'}
+APPROVED = {**EVENT, 'level': 'approved'}
+
+
+@pytest.fixture
+async def client(monkeypatch):
+    from main import app
+
+    async def check_role(token, app_name):
+        return TOKENS.get(token)
+
+    # До базы доходят только запросы, прошедшие проверку роли
+    async def create_event(db, event_data):
+        return SimpleNamespace(id=1)
+
+    async def create_events(db, events):
+        return CreateCalendarEventsBatchResponse(created=len(events), results=[])
+
+    async def update_event(db, update):
+        return SimpleNamespace(id=update.event_id, start_date=update.new_start_date, end_date=update.new_end_date)
+
+    monkeypatch.setattr(auth, 'AUTH_ENABLED', True)
+    monkeypatch.setattr(AuthService, 'check_role', staticmethod(check_role))
+    monkeypatch.setattr(CalendarService, 'create_event', staticmethod(create_event))
+    monkeypatch.setattr(CalendarService, 'create_events', staticmethod(create_events))
+    monkeypatch.setattr(CalendarService, 'update_event', staticmethod(update_event))
+    app.dependency_overrides[get_db] = lambda: None
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+            yield client
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+
+def bearer(token: str) -> dict:
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.mark.parametrize('headers', [{}, {'Authorization': 'Basic editor'}, bearer('unknown')])
+async def test_missing_or_rejected_token_is_401(client, headers):
+    response = await client.post('/api/v1/events', json=EVENT, headers=headers)
+
+    assert response.status_code == 401
+    assert response.headers['www-authenticate'] == 'Bearer'
+
+
+async def test_role_below_route_minimum_is_403(client):
+    assert (await client.post('/api/v1/events', json=EVENT, headers=bearer('viewer'))).status_code == 403
+    assert (await client.delete('/api/v1/auth/cache', headers=bearer('approver'))).status_code == 403
+
+
+@pytest.mark.parametrize('method, path, body', [
+    ('POST', '/api/v1/events', APPROVED),
+    ('POST', '/api/v1/events:batch', {'events': [EVENT, APPROVED]}),
+    ('PUT', '/api/v1/events/1', {'new_start_date': '2025-01-02', 'new_end_date': '2025-01-06', 'new_level': 'approved'}),
+])
+async def test_approving_needs_approver(client, method, path, body):
+    response = await client.request(method, path, json=body, headers=bearer('editor'))
+    assert response.status_code == 403
+
+    response = await client.request(method, path, json=body, headers=bearer('approver'))
+    assert response.status_code == 200
+
+
+async def test_editor_can_save_without_approving(client):
+    response = await client.post('/api/v1/events:batch', json={'events': [EVENT, EVENT]}, headers=bearer('editor'))
+
+    assert response.status_code == 200
+    assert response.json()['created'] == 2
+
+
+def test_disabled_auth_is_logged(monkeypatch, caplog):
+    monkeypatch.setattr(auth, 'AUTH_ENABLED', False)
+
+    auth.warn_if_disabled()
+
+    assert 'AUTH_ENABLED is off' in caplog.text
@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy import text
+
+from app import services
+from app.services import BitrixService
+from fake_bitrix import FakeBitrix
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def batch_mode(monkeypatch):
+    monkeypatch.setattr(services, 'BITRIX_BATCH', True)
+    monkeypatch.setattr(services, 'BITRIX_BACKOFF', 0)
+
+
+async def fetch_all(fake: FakeBitrix):
+    async with fake.client() as client:
+        return await BitrixService(None, client=client).fetch_records(
+            [int(d['ID']) for d in fake.departments], [int(e['ID']) for e in fake.employees],
+        )
+
+
+async def test_batch_packs_pages_into_commands(batch_mode):
+    fake = FakeBitrix(page_size=2)
+
+    data = await fetch_all(fake)
+
+    assert [e['id'] for e in data['employees']] == [int(e['ID']) for e in fake.employees]
+    assert len(data['departments']) == len(fake.departments)
+    # Первая страница каждого метода - обычный запрос, остальные - в batch по 50 команд:
+    # 156 страниц сотрудников и 40 страниц отделов
+    assert [method for method, _ in fake.calls].count('user.get') == 1
+    assert [method for method, _ in fake.calls].count('department.get') == 1
+    assert sorted(len(keys) for keys in fake.batch_calls()) == [5, 39, 50, 50, 50]
+
+
+async def test_batch_retries_only_failed_commands(batch_mode):
+    fake = FakeBitrix(page_size=1)
+    fake.failures = {'page_10': 1, 'page_60': 2}
+
+    async with fake.client() as client:
+        data = await BitrixService(None, client=client).fetch_records([int(d['ID']) for d in fake.departments], [])
+
+    expected = sorted(fake.departments, key=lambda d: d['NAME'], reverse=True)
+    assert [d['id'] for d in data['departments']] == [int(d['ID']) for d in expected]
+    batches = fake.batch_calls()
+    # 79 страниц в двух batch, затем повторы только команд с ошибками
+    assert sorted(len(keys) for keys in batches[:2]) == [29, 50]
+    assert sorted(batches[2:]) == [['page_10'], ['page_60'], ['page_60']]
+
+
+async def test_batch_gives_up_after_retries(batch_mode):
+    fake = FakeBitrix(page_size=1)
+    fake.failures = {'page_10': services.BITRIX_RETRIES + 1}
+
+    async with fake.client() as client:
+        with pytest.raises(ValueError, match='page_10'):
+            await BitrixService(None, client=client).fetch_records([], [])
+
+
+async def test_sync_with_fake_bitrix(db, sync_engine, batch_mode):
+    fake = FakeBitrix(page_size=7)
+
+    async with fake.client() as client:
+        await BitrixService(db, client=client).sync_with_bitrix()
+
+    department_ids = {int(d['ID']) for d in fake.departments}
+    links = {
+        (int(e['ID']), int(dep_id))
+        for e in fake.employees for dep_id in e['UF_DEPARTMENT'] or [] if int(dep_id) in department_ids
+    }
+    with sync_engine.connect() as conn:
+        assert conn.scalar(text('SELECT count(*) FROM employees')) == len(fake.employees)
+        assert conn.scalar(text('SELECT count(*) FROM departments')) == len(fake.departments)
+        assert set(conn.execute(text('SELECT employee_id, department_id FROM employee_department'))) == links
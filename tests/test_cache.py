@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import cache as cache_module
+from app.cache import TTLCache
+
+pytestmark = pytest.mark.anyio
+
+
+class Loader:
+    """Загрузчик, который ждёт release, чтобы промахи успели склеиться"""
+
+    def __init__(self, value='editor'):
+        self.value = value
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+
+async def test_concurrent_misses_share_one_load():
+    cache = TTLCache(maxsize=10, ttl=60)
+    loader = Loader()
+
+    tasks = [asyncio.create_task(cache.get_or_load('token', loader)) for _ in range(3)]
+    await asyncio.sleep(0)
+    loader.release.set()
+
+    assert await asyncio.gather(*tasks) == ['editor'] * 3
+    assert loader.calls == 1
+    assert await cache.get_or_load('token', loader) == 'editor'
+    assert cache.stats() == {'size': 1, 'maxsize': 10, 'hits': 1, 'misses': 1, 'coalesced': 2}
+
+
+async def test_cancelled_caller_does_not_cancel_waiters():
+    cache = TTLCache(maxsize=10, ttl=60)
+    loader = Loader()
+
+    first = asyncio.create_task(cache.get_or_load('token', loader))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(cache.get_or_load('token', loader))
+    await asyncio.sleep(0)
+    # Клиент, чей промах запустил загрузку, отключился
+    first.cancel()
+    await asyncio.sleep(0)
+    loader.release.set()
+
+    assert await waiter == 'editor'
+    assert first.cancelled()
+    assert loader.calls == 1
+    assert cache.get('token') == 'editor'
+
+
+async def test_failed_load_reaches_waiters_and_is_not_cached():
+    cache = TTLCache(maxsize=10, ttl=60)
+    loader = Loader(ValueError('auth service is down'))
+
+    tasks = [asyncio.create_task(cache.get_or_load('token', loader)) for _ in range(2)]
+    await asyncio.sleep(0)
+    loader.release.set()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert [type(result) for result in results] == [ValueError, ValueError]
+    assert len(cache) == 0
+
+
+async def test_negative_answers_expire_by_their_own_ttl(monkeypatch):
+    cache = TTLCache(maxsize=10, ttl=60)
+    now = 1000.0
+    monkeypatch.setattr(cache_module, 'time', SimpleNamespace(monotonic=lambda: now))
+
+    def ttl(role):
+        return 60 if role is not None else 5
+
+    async def rejected():
+        return None
+
+    async def accepted():
+        return 'viewer'
+
+    assert await cache.get_or_load('bad', rejected, ttl) is None
+    assert await cache.get_or_load('good', accepted, ttl) == 'viewer'
+
+    now += 10
+    missing = object()
+    assert cache.get('bad', missing) is missing
+    assert cache.get('good') == 'viewer'
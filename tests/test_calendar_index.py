@@ -0,0 +1,108 @@
+import asyncio
+import json
+from datetime import date
+
+import pytest
+
+from app import calendar_index as calendar_index_module, notify
+from app.calendar_index import CalendarIndex
+from app.notify import PgListener
+
+pytestmark = pytest.mark.anyio
+
+
+def event_payload(op: str, event_id: int, employee_id: int = 1, start: str = '2025-01-01',
+                  end: str = '2025-01-05', level: str = 'saved') -> str:
+    row = {
+        'id': event_id, 'employee_id': employee_id, 'event_type': 'vacation',
+        'start_date': start, 'end_date': end, 'level': level,
+    }
+    return json.dumps({'table': 'events', 'op': op, 'id': event_id, 'row': None if op == 'DELETE' else row})
+
+
+class SnapshotSession:
+    """
+    Сессия с заранее прочитанными строками; на первом запросе (пока load()
+    ждёт базу) приходят уведомления, как от LISTEN-соединения
+    """
+
+    def __init__(self, index: CalendarIndex, results, notifications):
+        self.index = index
+        self.results = list(results)
+        self.notifications = notifications
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        for payload in self.notifications:
+            self.index.handle_notification(payload)
+        self.notifications = []
+        rows = self.results.pop(0)
+        return type('Result', (), {'all': lambda self: rows})()
+
+
+async def test_notifications_during_load_are_applied_to_loaded_state(monkeypatch):
+    index = CalendarIndex()
+    employees = [(1, 'Сотрудник 1')]
+    # Снимок прочитан до коммитов, о которых пришли уведомления
+    events = [
+        (1, 1, 'vacation', date(2025, 1, 1), date(2025, 1, 5), 'saved'),
+        (3, 1, 'vacation', date(2025, 2, 1), date(2025, 2, 5), 'saved'),
+    ]
+    notifications = [
+        event_payload('UPDATE', 1, level='approved'),
+        event_payload('INSERT', 2, start='2025-01-10', end='2025-01-12'),
+        event_payload('DELETE', 3),
+    ]
+    monkeypatch.setattr(
+        calendar_index_module, 'SessionLocal', lambda: SnapshotSession(index, [employees, events], notifications),
+    )
+
+    await index.load()
+
+    assert index.ready
+    assert index.has_approved_overlap(1, date(2025, 1, 3), date(2025, 1, 3))
+    items = index.calendar_items(date(2025, 1, 1), date(2025, 2, 28))
+    assert [event['id'] for event in items[0]['events']] == [1, 2]
+
+
+async def test_failed_load_stops_queueing_notifications(monkeypatch):
+    index = CalendarIndex()
+
+    class BrokenSession(SnapshotSession):
+        async def execute(self, statement):
+            raise OSError('connection lost')
+
+    monkeypatch.setattr(calendar_index_module, 'SessionLocal', lambda: BrokenSession(index, [], []))
+
+    with pytest.raises(OSError):
+        await index.load()
+
+    assert not index.ready
+    index.handle_notification(event_payload('INSERT', 1))
+    assert 1 in index._events
+
+
+async def test_lost_listen_connection_marks_index_not_ready(monkeypatch):
+    index = CalendarIndex()
+    index.ready = True
+    listener = PgListener(dsn='postgresql://unused', reconnect_delay=0.01)
+    listener.subscribe('calendar_index', index.handle_notification)
+    listener.on_disconnect(index.unload)
+
+    async def connect(dsn):
+        raise OSError('connection refused')
+
+    monkeypatch.setattr(notify.asyncpg, 'connect', connect)
+    listener.start()
+    try:
+        await asyncio.sleep(0.05)
+    finally:
+        await listener.stop()
+
+    # Пока индекс не перезагружен после переподключения, чтения идут в базу
+    assert not index.ready
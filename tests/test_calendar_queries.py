@@ -0,0 +1,60 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import event, text
+
+from app.database import engine
+from app.services import CalendarService
+
+pytestmark = pytest.mark.anyio
+
+
+def seed(sync_engine, employees: int):
+    with sync_engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO employees (id, full_name) SELECT g, 'Сотрудник ' || g FROM generate_series(1, :n) g"
+        ), {'n': employees})
+        conn.execute(text(
+            "INSERT INTO events (employee_id, event_type, start_date, end_date, level) "
+            "SELECT g, 'vacation', DATE '2025-01-01' + k * 10, DATE '2025-01-01' + k * 10 + 3, 'saved' "
+            "FROM generate_series(1, :n) g, generate_series(0, 2) k"
+        ), {'n': employees})
+
+
+async def count_queries(db, start_date: date, end_date: date):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        items = await CalendarService.get_calendar(db, start_date, end_date)
+    finally:
+        event.remove(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+    return items, statements
+
+
+@pytest.mark.parametrize('employees', [10, 200])
+async def test_calendar_query_count_does_not_grow_with_employees(db, sync_engine, employees):
+    seed(sync_engine, employees)
+
+    items, statements = await count_queries(db, date(2025, 1, 1), date(2025, 1, 31))
+
+    assert len(items) == employees
+    assert all(len(item.events) == 3 for item in items)
+    # Один запрос с JOIN на весь период, без догрузки сотрудников по одному
+    assert len(statements) == 1
+
+
+async def test_calendar_groups_events_by_employee(db, sync_engine):
+    seed(sync_engine, 3)
+
+    items, _ = await count_queries(db, date(2025, 1, 4), date(2025, 1, 12))
+
+    assert [item.employee.id for item in items] == [1, 2, 3]
+    for item in items:
+        assert [(e.start, e.end) for e in item.events] == [
+            (date(2025, 1, 1), date(2025, 1, 4)),
+            (date(2025, 1, 11), date(2025, 1, 14)),
+        ]
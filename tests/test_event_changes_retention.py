@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import text
+
+from app.services import CalendarService, SyncTokenExpired
+
+pytestmark = pytest.mark.anyio
+
+
+def add_event(sync_engine, days_ago: int = 0) -> int:
+    """Событие через триггер попадает в журнал; days_ago состаривает его запись"""
+    with sync_engine.begin() as conn:
+        event_id = conn.scalar(text(
+            "INSERT INTO events (employee_id, event_type, start_date, end_date, level) "
+            "VALUES (1, 'vacation', DATE '2025-01-01', DATE '2025-01-03', 'saved') RETURNING id"
+        ))
+        conn.execute(text(
+            "UPDATE event_changes SET changed_at = now() - make_interval(days => :days) WHERE event_id = :id"
+        ), {'days': days_ago, 'id': event_id})
+    return event_id
+
+
+@pytest.fixture
+def employee(sync_engine):
+    with sync_engine.begin() as conn:
+        conn.execute(text("INSERT INTO employees (id, full_name) VALUES (1, 'Сотрудник 1')"))
+
+
+async def test_prune_expires_tokens_older_than_retention(db, sync_engine, employee):
+    old_token = await CalendarService.current_snapshot(db)
+    add_event(sync_engine, days_ago=40)
+    token = await CalendarService.current_snapshot(db)
+    recent = add_event(sync_engine)
+
+    assert await CalendarService.prune_changes(db, retention_days=30) == 1
+
+    with pytest.raises(SyncTokenExpired):
+        await CalendarService.get_changes(db, old_token)
+    changes = await CalendarService.get_changes(db, token)
+    assert [change.id for change in changes.changes] == [recent]
+
+
+async def test_prune_without_old_rows_keeps_tokens(db, sync_engine, employee):
+    token = await CalendarService.current_snapshot(db)
+    event_id = add_event(sync_engine, days_ago=10)
+
+    assert await CalendarService.prune_changes(db, retention_days=30) == 0
+
+    changes = await CalendarService.get_changes(db, token)
+    assert [change.id for change in changes.changes] == [event_id]
@@ -0,0 +1,126 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from app import response_cache as response_cache_module
+from app.response_cache import LocalBackend, RedisBackend, ResponseCache
+
+pytestmark = pytest.mark.anyio
+
+JAN = (date(2025, 1, 1), date(2025, 1, 31))
+FEB = (date(2025, 2, 1), date(2025, 2, 28))
+MAR = (date(2025, 3, 1), date(2025, 3, 31))
+
+
+@pytest.fixture(params=['local', 'redis'])
+def backend(request):
+    if request.param == 'local':
+        return LocalBackend()
+    fakeredis = pytest.importorskip('fakeredis')
+    return RedisBackend(client=fakeredis.aioredis.FakeRedis())
+
+
+class Renderer:
+    def __init__(self, body: bytes = b'[]'):
+        self.body = body
+        self.calls = 0
+
+    async def __call__(self) -> bytes:
+        self.calls += 1
+        return self.body
+
+
+async def get(cache: ResponseCache, kind: str, period, render, etag: str = '"v1"'):
+    return await cache.get_or_render(kind, *period, {}, render, {'ETag': etag})
+
+
+async def test_second_request_is_a_hit(backend):
+    cache = ResponseCache(backend)
+    render = Renderer(b'{"a": 1}')
+
+    first = await get(cache, 'calendar', JAN, render)
+    second = await get(cache, 'calendar', JAN, render)
+
+    assert first == second == (b'{"a": 1}', {'ETag': '"v1"'})
+    assert render.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Запись с другим ETag - промах
+    await get(cache, 'calendar', JAN, render, etag='"v2"')
+    assert render.calls == 2
+
+
+async def test_invalidation_drops_only_overlapping_ranges(backend):
+    cache = ResponseCache(backend)
+    renders = {period: Renderer() for period in (JAN, FEB, MAR)}
+    workload = Renderer()
+    for period, render in renders.items():
+        await get(cache, 'calendar', period, render)
+    await get(cache, 'workload', FEB, workload)
+
+    assert await cache.invalidate(['calendar'], date(2025, 1, 25), date(2025, 2, 3)) == 2
+
+    for period, render in renders.items():
+        await get(cache, 'calendar', period, render)
+    await get(cache, 'workload', FEB, workload)
+    assert [render.calls for render in renders.values()] == [2, 2, 1]
+    assert workload.calls == 1
+
+    # Без дат - все записи вида
+    assert await cache.invalidate(['calendar']) == 3
+
+
+async def test_render_racing_an_invalidation_is_not_cached(backend):
+    cache = ResponseCache(backend)
+
+    async def render():
+        # Данные изменились, пока строился ответ: он может быть уже устаревшим
+        await cache.invalidate(['calendar'], *JAN)
+        return b'stale'
+
+    assert await get(cache, 'calendar', JAN, render) == (b'stale', {'ETag': '"v1"'})
+
+    fresh = Renderer(b'fresh')
+    assert (await get(cache, 'calendar', JAN, fresh))[0] == b'fresh'
+    assert fresh.calls == 1
+
+
+async def test_local_backend_evicts_least_recently_used_by_bytes():
+    entry_size = len(b'{"ETag": "\\"v1\\""}\n') + 100
+    cache = ResponseCache(LocalBackend(max_bytes=entry_size * 2))
+    renders = {period: Renderer(b'x' * 100) for period in (JAN, FEB, MAR)}
+
+    await get(cache, 'calendar', JAN, renders[JAN])
+    await get(cache, 'calendar', FEB, renders[FEB])
+    await get(cache, 'calendar', JAN, renders[JAN])  # январь теперь свежее февраля
+    await get(cache, 'calendar', MAR, renders[MAR])
+
+    assert cache.backend.bytes == entry_size * 2
+    await get(cache, 'calendar', JAN, renders[JAN])
+    await get(cache, 'calendar', FEB, renders[FEB])
+    assert [render.calls for render in renders.values()] == [1, 2, 1]
+
+    # Ответ больше лимита не кэшируется вовсе
+    huge = Renderer(b'x' * entry_size * 3)
+    await get(cache, 'workload', JAN, huge)
+    await get(cache, 'workload', JAN, huge)
+    assert huge.calls == 2
+
+
+async def test_redis_index_drops_expired_members(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    backend = RedisBackend(client=fakeredis.aioredis.FakeRedis(), ttl=60)
+    cache = ResponseCache(backend)
+    now = 1_000_000.0
+    monkeypatch.setattr(response_cache_module, 'time', SimpleNamespace(time=lambda: now))
+
+    await get(cache, 'calendar', JAN, Renderer())
+    await get(cache, 'calendar', FEB, Renderer())
+    assert (await backend.stats())['entries'] == 2
+
+    # Ключи записей истекли, а индекс продлевается новыми записями
+    now += 61
+    await get(cache, 'calendar', MAR, Renderer())
+
+    assert await backend.client.zcard(backend._index('calendar')) == 1
+    assert (await backend.stats())['entries'] == 1
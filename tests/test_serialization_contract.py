@@ -0,0 +1,80 @@
+from datetime import date
+
+import orjson
+import pytest
+from sqlalchemy import text
+
+from app.services import CalendarService, WorkloadService
+from app.workload import WORKLOAD_FORMATS
+
+jsonschema = pytest.importorskip('jsonschema')
+
+pytestmark = pytest.mark.anyio
+
+START, END = date(2025, 1, 1), date(2025, 2, 28)
+
+
+@pytest.fixture(scope='module')
+def openapi():
+    from main import app
+
+    return app.openapi()
+
+
+def response_schema(openapi: dict, path: str) -> dict:
+    """Схема ответа 200 маршрута; ссылки на components разрешаются внутри того же документа"""
+    schema = openapi['paths'][path]['get']['responses']['200']['content']['application/json']['schema']
+    return {**schema, 'components': openapi['components']}
+
+
+def component_schema(openapi: dict, name: str) -> dict:
+    return {'$ref': f'#/components/schemas/{name}', 'components': openapi['components']}
+
+
+def validate(instance, schema: dict):
+    jsonschema.Draft202012Validator(schema).validate(instance)
+
+
+def seed(sync_engine):
+    with sync_engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO employees (id, full_name) SELECT g, 'Сотрудник ' || g FROM generate_series(1, 5) g"
+        ))
+        conn.execute(text(
+            "INSERT INTO events (employee_id, event_type, start_date, end_date, level) "
+            "SELECT g, CASE WHEN k = 0 THEN 'vacation' ELSE 'business_trip' END, "
+            "DATE '2025-01-01' + g + k * 20, DATE '2025-01-01' + g + k * 20 + 4, 'saved' "
+            "FROM generate_series(1, 4) g, generate_series(0, 1) k"
+        ))
+        # У пятого сотрудника нет записей: в ответе он должен быть с нулями
+        conn.execute(text(
+            "INSERT INTO daily_workloads (employee_id, date, percent) "
+            "SELECT g, d::date, (g * 10 + extract(day FROM d))::float "
+            "FROM generate_series(1, 4) g, generate_series(DATE '2025-01-10', DATE '2025-02-10', INTERVAL '1 day') d "
+            "WHERE extract(dow FROM d) NOT IN (0, 6)"
+        ))
+
+
+async def test_calendar_json_matches_route_schema(db, sync_engine, openapi):
+    seed(sync_engine)
+
+    body = orjson.loads(await CalendarService.get_calendar_json(db, START, END))
+
+    assert body
+    validate(body, response_schema(openapi, '/api/v1/calendar'))
+    # Быстрый путь отдаёт то же, что и модели pydantic
+    models = await CalendarService.get_calendar(db, START, END)
+    assert body == [item.model_dump(mode='json') for item in models]
+
+
+@pytest.mark.parametrize('aggregate', ['python', 'sql'])
+@pytest.mark.parametrize('format', list(WORKLOAD_FORMATS))
+async def test_workload_json_matches_route_schema(db, sync_engine, openapi, aggregate, format):
+    seed(sync_engine)
+
+    body = orjson.loads(await WorkloadService.get_workload_json(db, START, END, aggregate, format))
+
+    validate(body, response_schema(openapi, '/api/v1/workload'))
+    validate(body, component_schema(openapi, WORKLOAD_FORMATS[format].__name__))
+    model = await WorkloadService.get_workload(db, START, END, aggregate, format)
+    assert body == model.model_dump(mode='json')
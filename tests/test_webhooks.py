@@ -0,0 +1,112 @@
+from pathlib import Path
+
+import httpx
+import pytest
+from sqlalchemy import text
+
+from app import services, webhooks
+from app.webhooks import WebhookBuffer, replay
+from fake_bitrix import FakeBitrix
+
+pytestmark = pytest.mark.anyio
+
+# Записанные вебхуки (формат BITRIX_WEBHOOK_RECORD): повторы по сотрудникам 3 и 5, *DELETE
+# для сотрудника 6, который в битриксе есть, и для 900/901, которых нет; отдел 999 битрикс
+# отдаёт без названия - такая запись в базу не ложится
+RECORDED = Path(__file__).resolve().parent / 'webhooks_recorded.jsonl'
+
+
+@pytest.fixture
+def fake():
+    fake = FakeBitrix()
+    fake.departments.append({'ID': '999', 'NAME': None})
+    return fake
+
+
+@pytest.fixture
+def seeded(sync_engine):
+    with sync_engine.begin() as conn:
+        conn.execute(text("INSERT INTO employees (id, full_name) VALUES (900, 'Без истории'), (901, 'С историей')"))
+        conn.execute(text(
+            "INSERT INTO events (employee_id, event_type, start_date, end_date, level) "
+            "VALUES (901, 'vacation', DATE '2025-01-01', DATE '2025-01-03', 'saved')"
+        ))
+
+
+def employee_ids(sync_engine):
+    with sync_engine.connect() as conn:
+        return set(conn.scalars(text('SELECT id FROM employees')))
+
+
+async def test_replay_applies_coalesced_events(db, sync_engine, seeded, fake):
+    async with fake.client() as client:
+        result = await replay(RECORDED, WebhookBuffer(client=client))
+
+    # Девять событий по семи записям: сотрудники перечитываются одним запросом
+    assert [method for method, _ in fake.calls].count('user.get') == 1
+    assert result['counts']['employees'] == {'inserted': 3, 'updated': 0, 'deleted': 1}
+    assert result['counts']['departments']['inserted'] == 1
+    # 6 есть в битриксе - DELETE не применяется; 901 пропал, но у него есть события
+    assert employee_ids(sync_engine) == {3, 5, 6, 901}
+    assert result['retry'] == [('department', 999)]
+    assert result['failed'] == []
+
+
+async def test_failing_record_is_retried_then_parked(db, sync_engine, seeded, fake, monkeypatch):
+    monkeypatch.setattr(webhooks, 'BITRIX_WEBHOOK_MAX_ATTEMPTS', 2)
+
+    async with fake.client() as client:
+        buffer = WebhookBuffer(client=client)
+        await replay(RECORDED, buffer)
+        # Повтор несёт только запись с ошибкой, новое событие применяется вместе с ней
+        buffer.add('employee', 'upsert', 7)
+        result = await buffer.flush()
+
+        assert result['counts']['employees']['inserted'] == 1
+        assert result['retry'] == []
+        assert result['failed'] == [('department', 999)]
+        assert ('department', 999) in buffer.failed
+        assert await buffer.flush() is None
+
+        # Новое событие по отложенной записи снова даёт ей шанс
+        fake.departments[-1]['NAME'] = 'Новый отдел'
+        buffer.add('department', 'upsert', 999)
+        result = await buffer.flush()
+
+    assert result['counts']['departments']['inserted'] == 1
+    assert buffer.failed == {}
+    assert 7 in employee_ids(sync_engine)
+
+
+async def test_unreachable_bitrix_requeues_whole_batch(monkeypatch):
+    monkeypatch.setattr(services, 'BITRIX_BACKOFF', 0)
+
+    def handle(request):
+        raise httpx.ConnectError('down', request=request)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handle)) as client:
+        buffer = WebhookBuffer(client=client)
+        buffer.add('employee', 'upsert', 3)
+        buffer.add('department', 'delete', 1)
+        with pytest.raises(httpx.ConnectError):
+            await buffer.flush()
+
+    # Недоступность битрикса не считается неудачей записи
+    assert set(buffer._pending) == {('employee', 3), ('department', 1)}
+    assert buffer._attempts == {}
+
+
+@pytest.mark.parametrize('content_type, body', [
+    ('application/x-www-form-urlencoded', 'event=ONUSERUPDATE&data[FIELDS][ID]=abc&auth[application_token]=test-app-token'),
+    ('application/json', '{"event": "ONUSERUPDATE", "data": "5", "auth": {"application_token": "test-app-token"}}'),
+    ('application/json', '[1, 2]'),
+    ('application/json', '{"auth": "test-app-token"'),
+])
+async def test_malformed_webhook_is_rejected(monkeypatch, content_type, body):
+    from main import app
+
+    monkeypatch.setattr(webhooks, 'BITRIX_APP_TOKEN', 'test-app-token')
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        response = await client.post('/api/v1/bitrix/events', content=body, headers={'content-type': content_type})
+
+    assert response.status_code == 400